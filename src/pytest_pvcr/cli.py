@@ -0,0 +1,161 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from .rerecord import find_cassettes, rerecord
+
+
+def _rerecord(args: argparse.Namespace) -> int:
+    changed = 0
+    for changes, skips in rerecord(args.paths, args.jobs, args.timeout, args.dry_run):
+        for change in changes:
+            changed += 1
+            print(
+                f"changed: {change.path} {change.args} "
+                f"(iteration {change.iteration}): {', '.join(change.fields)}"
+            )
+
+        for skip in skips:
+            print(
+                f"skipped: {skip.path} {skip.args} "
+                f"(iteration {skip.iteration}): {skip.reason}"
+            )
+
+    print(f"{changed} changed command(s)")
+    return 0
+
+
+def _stats(args: argparse.Namespace) -> int:
+    from .stats import stats
+
+    json.dump(stats(args.paths, args.jobs, args.top), sys.stdout, indent=2)
+    print()
+    return 0
+
+
+def _sqlite_import(args: argparse.Namespace) -> int:
+    from .recordings import SqliteDatabase
+
+    database = SqliteDatabase(args.database)
+    try:
+        paths = find_cassettes(args.paths)
+        count = database.import_cassettes(paths)
+    finally:
+        database.close()
+
+    print(f"{count} recording(s) imported from {len(paths)} file(s)")
+    return 0
+
+
+def _sqlite_export(args: argparse.Namespace) -> int:
+    from .recordings import SqliteDatabase
+
+    database = SqliteDatabase(args.database)
+    try:
+        paths = database.export_cassettes(args.directory)
+    finally:
+        database.close()
+
+    for path in paths:
+        print(f"exported: {path}")
+    print(f"{len(paths)} file(s) exported")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="pvcr", description="PyTest Process VCR")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rerecord_parser = subparsers.add_parser(
+        "rerecord",
+        help="Re-execute recorded commands and update the recordings files.",
+    )
+    rerecord_parser.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        default=[Path(".")],
+        help="Recordings files or directories. Default to the current directory.",
+    )
+    rerecord_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Maximum number of commands executed concurrently.",
+    )
+    rerecord_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Timeout in seconds for each command.",
+    )
+    rerecord_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report changes without updating the recordings files.",
+    )
+    rerecord_parser.set_defaults(func=_rerecord)
+
+    stats_parser = subparsers.add_parser(
+        "stats",
+        help="Report statistics of recordings files as JSON.",
+    )
+    stats_parser.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        default=[Path(".")],
+        help="Recordings files or directories. Default to the current directory.",
+    )
+    stats_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Maximum number of files decoded concurrently.",
+    )
+    stats_parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of largest and duplicate outputs reported. Default to 10.",
+    )
+    stats_parser.set_defaults(func=_stats)
+
+    import_parser = subparsers.add_parser(
+        "sqlite-import",
+        help="Import recordings files into a SQLite database.",
+    )
+    import_parser.add_argument("database", type=Path, help="SQLite database.")
+    import_parser.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        default=[Path(".")],
+        help="Recordings files or directories. Default to the current directory.",
+    )
+    import_parser.set_defaults(func=_sqlite_import)
+
+    export_parser = subparsers.add_parser(
+        "sqlite-export",
+        help="Export the cassettes of a SQLite database to YAML recordings files.",
+    )
+    export_parser.add_argument("database", type=Path, help="SQLite database.")
+    export_parser.add_argument(
+        "-d",
+        "--directory",
+        type=Path,
+        default=None,
+        help="Directory the recordings files are written to. "
+        "Default to the database directory.",
+    )
+    export_parser.set_defaults(func=_sqlite_export)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
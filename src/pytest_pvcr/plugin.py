@@ -1,14 +1,75 @@
-from collections.abc import Iterator
+from __future__ import annotations
+
+import json
+import re
+import sys
+from collections.abc import Hashable, Iterator
 from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
 
 import pytest
 from _pytest.config import Config
 from _pytest.config.argparsing import Parser
 from _pytest.fixtures import SubRequest
+from _pytest.main import Session
 from _pytest.mark.structures import Mark
+from _pytest.nodes import Item
+from _pytest.terminal import TerminalReporter
+
+from .wrapper import (
+    SubprocessWrapper,
+    install_wrapper,
+    patch_subprocess,
+    uninstall_wrapper,
+)
+
+# The recordings module, and PyYAML with it, is only imported when a
+# collected test uses pvcr.
+if TYPE_CHECKING:
+    from subprocess import CompletedProcess
+
+    from .recordings import (
+        Cassette,
+        CassetteBundle,
+        CassetteCache,
+        MatchStrategy,
+        Recordings,
+        ReplayTable,
+        ResourceUsage,
+        SqliteDatabase,
+    )
+
+STORAGE_FORMATS = ("yaml", "journal", "indexed", "sqlite")
+LAYOUTS = ("test", "module")
+
+
+class PvcrSettings(NamedTuple):
+    """pvcr settings of a test, parsed from its markers at collection."""
 
-from .recordings import Recordings
-from .wrapper import SubprocessWrapper, install_wrapper, uninstall_wrapper
+    wait: bool
+    fuzzy_matchers: list[str]
+    match_strategy: MatchStrategy
+    keep_stdin: bool
+    pure_commands: list[re.Pattern[str]]
+    exception_delay: float
+
+
+replay_tables_key: pytest.StashKey[
+    dict[tuple[Hashable, MatchStrategy], ReplayTable]
+] = pytest.StashKey()
+cassette_cache_key: pytest.StashKey[CassetteCache | None] = pytest.StashKey()
+modified_cassettes_key: pytest.StashKey[dict[Hashable, Cassette]] = pytest.StashKey()
+bundles_key: pytest.StashKey[dict[Path, CassetteBundle]] = pytest.StashKey()
+database_key: pytest.StashKey[SqliteDatabase] = pytest.StashKey()
+preloaded_modules_key: pytest.StashKey[set[str]] = pytest.StashKey()
+bypassed_key: pytest.StashKey[dict[str, int]] = pytest.StashKey()
+pure_results_key: pytest.StashKey[
+    dict[tuple, tuple[CompletedProcess, float, ResourceUsage | None]]
+] = pytest.StashKey()
+usage_key: pytest.StashKey[list[tuple[str, float, ResourceUsage | None]]] = (
+    pytest.StashKey()
+)
+pvcr_settings_key: pytest.StashKey[PvcrSettings] = pytest.StashKey()
 
 
 def pytest_configure(config: Config) -> None:
@@ -18,13 +79,297 @@ def pytest_configure(config: Config) -> None:
         "pvcr_fuzzy_matcher(regex): Add a fuzzy matcher regex for PVCR recordings.",
     )
 
-    install_wrapper()
+    if (
+        config.getoption("--pvcr-cache")
+        and not config.getoption("--pvcr-cache-dir")
+        and config.cache is None
+    ):
+        raise pytest.UsageError(
+            "--pvcr-cache requires the cacheprovider plugin, use --pvcr-cache-dir"
+        )
+
+    if (
+        config.getoption("--pvcr-layout") == "module"
+        and config.getoption("--pvcr-storage") != "yaml"
+    ):
+        raise pytest.UsageError("--pvcr-layout=module requires --pvcr-storage=yaml")
+
+    # Modules imported from now on are imported by the collection
+    config.stash[preloaded_modules_key] = set(sys.modules)
+
+
+def _cassette_cache(config: Config) -> CassetteCache | None:
+    """Return the cassette cache requested on the command line, if any."""
+    if cassette_cache_key in config.stash:
+        return config.stash[cassette_cache_key]
+
+    from .recordings import CassetteCache
+
+    cache = None
+    cache_dir = config.getoption("--pvcr-cache-dir")
+    if cache_dir:
+        cache = CassetteCache(Path(cache_dir))
+    elif config.getoption("--pvcr-cache"):
+        cache = CassetteCache(config.cache.mkdir("pvcr"))
+
+    config.stash[cassette_cache_key] = cache
+    return cache
 
 
 def pytest_unconfigure() -> None:
     uninstall_wrapper()
 
 
+def pytest_sessionfinish(session: Session) -> None:
+    """Compact the cassettes modified during the session."""
+    cassettes = session.config.stash.get(modified_cassettes_key, {})
+    for cassette in cassettes.values():
+        cassette.compact()
+
+    database = session.config.stash.get(database_key, None)
+    if database is not None:
+        database.close()
+        del session.config.stash[database_key]
+
+
+def pytest_terminal_summary(terminalreporter: TerminalReporter) -> None:
+    """Report the live executions bypassing pvcr during pvcr tests, and the
+    resources used by the recorded commands."""
+    bypassed = terminalreporter.config.stash.get(bypassed_key, {})
+    if bypassed:
+        terminalreporter.write_sep("=", "pvcr live executions bypassing pvcr")
+        for nodeid, count in bypassed.items():
+            terminalreporter.write_line(f"{nodeid}: {count}")
+
+    usage = terminalreporter.config.stash.get(usage_key, [])
+    if usage:
+        _write_usage_report(terminalreporter, usage)
+
+
+def _write_usage_report(
+    terminalreporter: TerminalReporter,
+    usage: list[tuple[str, float, ResourceUsage | None]],
+) -> None:
+    """Report the resources used by the executed commands of each program.
+
+    Args:
+        terminalreporter: the terminal reporter
+        usage: the program, duration and resource usage of each executed
+            command
+    """
+    # runs, wall time, user time, system time and max RSS by program
+    programs: dict[str, list] = {}
+    for program, duration, resources in usage:
+        totals = programs.setdefault(program, [0, 0.0, 0.0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += duration / 1000000
+        if resources is not None:
+            totals[2] += resources.utime
+            totals[3] += resources.stime
+            totals[4] = max(totals[4], resources.maxrss)
+
+    terminalreporter.write_sep("=", "pvcr resource usage of executed commands")
+    width = max(len("program"), *(len(program) for program in programs))
+    terminalreporter.write_line(
+        f"{'program':<{width}} {'runs':>6} {'wall (s)':>10} {'user (s)':>10} "
+        f"{'sys (s)':>10} {'max RSS (MiB)':>14}"
+    )
+    for program, (runs, wall, utime, stime, maxrss) in sorted(
+        programs.items(), key=lambda item: item[1][1], reverse=True
+    ):
+        terminalreporter.write_line(
+            f"{program:<{width}} {runs:>6} {wall:>10.3f} {utime:>10.3f} "
+            f"{stime:>10.3f} {maxrss / 1024:>14.1f}"
+        )
+
+
+def _recordings_suffix(config: Config) -> str:
+    """Return the recordings file suffix of the selected storage format."""
+    from .recordings import CASSETTE_FORMATS
+
+    return CASSETTE_FORMATS[config.getoption("--pvcr-storage")].suffix
+
+
+def _test_id(item: Item) -> str:
+    """Return the id of a test within its module."""
+    return item.nodeid.split("::", 1)[-1]
+
+
+def _bundle(config: Config, rec_dir: Path) -> CassetteBundle:
+    """Return the cassette bundle replacing a recordings directory.
+
+    Bundles are shared by the collection and the tests of a module, so a
+    bundle file is read once.
+    """
+    from .recordings import CassetteBundle
+
+    path = rec_dir.parent / f"{rec_dir.name}{CassetteBundle.suffix}"
+    bundles = config.stash.setdefault(bundles_key, {})
+    if path not in bundles:
+        bundles[path] = CassetteBundle(path, _cassette_cache(config))
+
+    return bundles[path]
+
+
+def _database(config: Config) -> SqliteDatabase:
+    """Return the SQLite database storing all the cassettes of the session."""
+    if database_key not in config.stash:
+        from .recordings import SqliteDatabase
+
+        path = config.getoption("--pvcr-database")
+        if path is None:
+            path = config.rootpath / f"recordings{SqliteDatabase.suffix}"
+        config.stash[database_key] = SqliteDatabase(Path(path))
+
+    return config.stash[database_key]
+
+
+def _open_cassette(config: Config, rec_dir: Path, item: Item) -> Cassette:
+    """Open the cassette of a test stored in a recordings directory."""
+    from .recordings import open_cassette
+
+    if config.getoption("--pvcr-storage") == "sqlite":
+        database = _database(config)
+        return database.cassette(database.name(rec_dir / item.function.__name__))
+
+    suffix = _recordings_suffix(config)
+    recordings_file = rec_dir / f"{item.function.__name__}{suffix}"
+    if config.getoption("--pvcr-layout") == "module":
+        return _bundle(config, rec_dir).cassette(_test_id(item), recordings_file)
+
+    return open_cassette(recordings_file, _cassette_cache(config))
+
+
+def _item_cassette(item: Item) -> Cassette | None:
+    """Return the default cassette of a test item."""
+    if getattr(item, "function", None) is None:
+        return None
+
+    module = item.path
+    return _open_cassette(item.config, module.parent / "recordings" / module.stem, item)
+
+
+def _parse_settings(item: Item) -> PvcrSettings | None:
+    """Parse the pvcr settings of a test from its markers.
+
+    Returns:
+        the test settings, or None if the test is not marked with pvcr
+    """
+    markers = list(item.iter_markers(name="pvcr"))
+    if not markers:
+        return None
+
+    from .recordings import MatchStrategy
+
+    config = item.config
+    fuzzy_matchers = list(config.getoption("--pvcr-fuzzy-matcher") or [])
+    for marker in item.iter_markers(name="pvcr_fuzzy_matcher"):
+        if not marker.args:
+            continue
+
+        fuzzy_matchers.append(marker.args[0])
+
+    # Insert automatic fuzzy matcher if requested
+    if config.getoption("--pvcr-auto-fuzzy-match"):
+        fuzzy_matchers.insert(0, str(item.path.parent.parent))
+
+    pure_commands = list(config.getoption("--pvcr-pure-command") or [])
+    pure_commands.extend(markers[0].kwargs.get("pure", []))
+
+    try:
+        match_strategy = MatchStrategy(markers[0].kwargs.get("match_on", "default"))
+        pure_commands = [re.compile(pattern) for pattern in pure_commands]
+    except (ValueError, re.error) as e:
+        raise pytest.UsageError(f"{item.nodeid}: {e}") from e
+
+    return PvcrSettings(
+        markers[0].kwargs.get("wait", True),
+        fuzzy_matchers,
+        match_strategy,
+        markers[0].kwargs.get("keep_stdin", False),
+        pure_commands,
+        markers[0].kwargs.get("exception_delay", 0.0),
+    )
+
+
+def pytest_collection_modifyitems(items: list[Item]) -> None:
+    """Request the pvcr fixture for the tests marked with pvcr only.
+
+    Unmarked tests do not pay for the pvcr fixture and its markers parsing.
+    """
+    for item in items:
+        fixturenames = getattr(item, "fixturenames", None)
+        if fixturenames is None:
+            continue
+
+        settings = _parse_settings(item)
+        if settings is None:
+            continue
+
+        # Set up pvcr before the other function fixtures of the test, so
+        # that the commands they run are recorded too
+        item.stash[pvcr_settings_key] = settings
+        if "pvcr" in fixturenames:
+            fixturenames.remove("pvcr")
+        fixturenames.insert(0, "pvcr")
+
+
+def _write_durations(session: Session, durations_file: Path) -> None:
+    """Write the expected duration of all collected pvcr tests.
+
+    The duration of a test is the total duration of its recorded commands
+    when they are executed or replayed with wait, and zero when they are
+    replayed without wait. Tests without recordings are left out. The file
+    maps test node ids to seconds and existing entries are kept, so it can
+    be shared with the durations file of a test scheduler.
+    """
+    from .recordings import recorded_duration
+
+    config = session.config
+    record_mode = config.getoption("--pvcr-record-mode")
+
+    durations = {}
+    if durations_file.exists():
+        durations = json.loads(durations_file.read_text())
+
+    for item in session.items:
+        settings = item.stash.get(pvcr_settings_key, None)
+        if settings is None:
+            continue
+
+        cassette = _item_cassette(item)
+        if cassette is None:
+            continue
+
+        duration = recorded_duration(cassette)
+        if duration is None:
+            continue
+
+        if record_mode != "all" and not settings.wait:
+            duration = 0.0
+
+        durations[item.nodeid] = duration
+
+    durations_file.write_text(json.dumps(durations, indent=2, sort_keys=True))
+
+
+def pytest_collection_finish(session: Session) -> None:
+    config = session.config
+    if not any(pvcr_settings_key in item.stash for item in session.items):
+        return
+
+    # Install the wrapper, including in the modules imported by the collection
+    preloaded = config.stash[preloaded_modules_key]
+    install_wrapper(name for name in list(sys.modules) if name not in preloaded)
+    if config.getoption("--pvcr-patch-subprocess"):
+        patch_subprocess()
+
+    # Only the controller writes the durations file when running with xdist
+    durations_file = config.getoption("--pvcr-durations")
+    if durations_file and not hasattr(config, "workerinput"):
+        _write_durations(session, Path(durations_file))
+
+
 def pytest_addoption(parser: Parser) -> None:
     group = parser.getgroup("pvcr")
     group.addoption(
@@ -50,6 +395,63 @@ def pytest_addoption(parser: Parser) -> None:
         action="store_true",
         help="Enable automatic fuzzy matching for test path.",
     )
+    group.addoption(
+        "--pvcr-cache",
+        action="store_true",
+        default=False,
+        help="Cache decoded recordings files in the pytest cache directory.",
+    )
+    group.addoption(
+        "--pvcr-cache-dir",
+        action="store",
+        default=None,
+        help="Cache decoded recordings files in this directory.",
+    )
+    group.addoption(
+        "--pvcr-durations",
+        action="store",
+        default=None,
+        help="Write the expected duration of pvcr tests to this JSON file.",
+    )
+    group.addoption(
+        "--pvcr-storage",
+        action="store",
+        default="yaml",
+        choices=STORAGE_FORMATS,
+        help='Recordings file format. Default to "yaml".',
+    )
+    group.addoption(
+        "--pvcr-database",
+        action="store",
+        default=None,
+        help="SQLite database of the sqlite storage format. "
+        "Default to recordings.sqlite3 in the root directory.",
+    )
+    group.addoption(
+        "--pvcr-layout",
+        action="store",
+        default="test",
+        choices=LAYOUTS,
+        help='Store recordings in one file per "test" or per "module". '
+        'Default to "test".',
+    )
+    group.addoption(
+        "--pvcr-pure-command",
+        action="append",
+        help="Add a regex of pure commands, executed once per session when recording.",
+    )
+    group.addoption(
+        "--pvcr-usage-report",
+        action="store_true",
+        help="Report the resources used by the commands executed when recording.",
+    )
+    group.addoption(
+        "--pvcr-patch-subprocess",
+        action="store_true",
+        default=False,
+        help="Also patch subprocess.run() in place, for modules imported before "
+        "pvcr, and count live executions bypassing pvcr.",
+    )
 
 
 @pytest.fixture
@@ -94,46 +496,86 @@ def recordings_dir(request: SubRequest) -> str:
     return str(module.parent / "recordings" / module.stem)
 
 
-@pytest.fixture(autouse=True)
-def pvcr(
-    request: SubRequest,
-    pvcr_markers: list[Mark],
-    pvcr_fuzzy_matchers: list[Mark],
-    pvcr_global_fuzzy_matchers: list[str],
-    pvcr_auto_fuzzy_match: bool,
-    recordings_dir: str,
-    pvcr_record_mode: str,
-    pvcr_block_run: bool,
-) -> Iterator[Recordings | None]:
-    if not pvcr_markers:
+@pytest.fixture(scope="module")
+def pvcr_bundle(request: SubRequest, recordings_dir: str) -> Iterator[CassetteBundle]:
+    """Return the cassette bundle of a module, saved at module teardown."""
+    bundle = _bundle(request.config, Path(recordings_dir))
+    yield bundle
+
+    bundle.save()
+    request.config.stash[bundles_key].pop(bundle.path, None)
+
+
+@pytest.fixture
+def pvcr(request: SubRequest) -> Iterator[Recordings | None]:
+    """Record and replay the processes of a test marked with pvcr.
+
+    The fixture is requested for marked tests at collection, see
+    pytest_collection_modifyitems().
+    """
+    settings = request.node.stash.get(pvcr_settings_key, None)
+    if settings is None:
         SubprocessWrapper.pvcr_enabled = False
         yield None
     else:
+        from .recordings import Recordings, ReplayTable
+
+        config = request.config
+        pvcr_record_mode = config.getoption("--pvcr-record-mode") or "none"
+
         SubprocessWrapper.pvcr_enabled = True
+        SubprocessWrapper.pvcr_bypassed = 0
+        SubprocessWrapper.pvcr_pure_commands = settings.pure_commands
+        SubprocessWrapper.pvcr_pure_results = config.stash.setdefault(
+            pure_results_key, {}
+        )
+        if config.getoption("--pvcr-usage-report"):
+            SubprocessWrapper.pvcr_usage = config.stash.setdefault(usage_key, [])
         SubprocessWrapper.pvcr_current_request = request
-        SubprocessWrapper.pvcr_do_wait = pvcr_markers[0].kwargs.get("wait", True)
-        SubprocessWrapper.pvcr_block_run = pvcr_block_run
+        SubprocessWrapper.pvcr_do_wait = settings.wait
+        SubprocessWrapper.pvcr_exception_delay = settings.exception_delay
+        SubprocessWrapper.pvcr_block_run = bool(config.getoption("--pvcr-block-run"))
         rec_dir = Path(request.getfixturevalue("recordings_dir"))
-        recordings_file = rec_dir / f"{request.function.__name__}.yaml"
+        if config.getoption("--pvcr-layout") == "module":
+            # Saves the bundle at module teardown
+            request.getfixturevalue("pvcr_bundle")
+        cassette = _open_cassette(config, rec_dir, request.node)
 
-        fuzzy_matchers = list(pvcr_global_fuzzy_matchers)
-        for marker in pvcr_fuzzy_matchers:
-            if not marker.args:
-                continue
+        match_strategy = settings.match_strategy
 
-            fuzzy_matchers.append(marker.args[0])
-
-        # Insert automatic fuzzy matcher if requested
-        if pvcr_auto_fuzzy_match:
-            module = request.node.path
-            fuzzy_matchers.insert(0, str(module.parent.parent))
+        replay_table = None
+        if pvcr_record_mode == "none":
+            tables = config.stash.setdefault(replay_tables_key, {})
+            table_key = (cassette.identity, match_strategy)
+            replay_table = tables.get(table_key)
+            if replay_table is None:
+                replay_table = ReplayTable.from_cassette(cassette, match_strategy)
+                # Only the table of the last test is kept, for the next tests
+                # sharing its recordings file such as parametrized ones
+                tables.clear()
+                tables[table_key] = replay_table
 
         SubprocessWrapper.pvcr_history = Recordings(
-            recordings_file, pvcr_record_mode, fuzzy_matchers
+            cassette,
+            pvcr_record_mode,
+            settings.fuzzy_matchers,
+            replay_table,
+            match_strategy,
+            keep_stdin=settings.keep_stdin,
         )
         yield SubprocessWrapper.pvcr_history
 
         # teardown
+        cassette = SubprocessWrapper.pvcr_history.cassette
+        if cassette.modified:
+            modified = config.stash.setdefault(modified_cassettes_key, {})
+            modified[cassette.identity] = cassette
+
+        if SubprocessWrapper.pvcr_bypassed:
+            bypassed = config.stash.setdefault(bypassed_key, {})
+            bypassed[request.node.nodeid] = SubprocessWrapper.pvcr_bypassed
+
         SubprocessWrapper.pvcr_enabled = False
         SubprocessWrapper.pvcr_current_request = None
         SubprocessWrapper.pvcr_history = None
+        SubprocessWrapper.pvcr_usage = None
@@ -1,74 +1,1468 @@
 import base64
+import contextlib
+import functools
+import hashlib
+import heapq
+import json
+import locale
 import logging
+import os
+import pickle
+import random
 import re
+import shlex
+import tempfile
+import weakref
+from collections.abc import Callable, Hashable, Iterable, Sequence
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
-
-from yaml import dump, load
-
-try:
-    from yaml import CDumper as Dumper
-    from yaml import CLoader as Loader
-except ImportError:
-    from yaml import Dumper, Loader
+from subprocess import CompletedProcess, TimeoutExpired
+from types import MappingProxyType
+from typing import IO, Any, NamedTuple
 
 logger = logging.getLogger("pvcr")
 
 
 FUZZY_PLACEHOLDER = "[[FUZZY_VALUE]]"
+FUZZY_PLACEHOLDER_BYTES = FUZZY_PLACEHOLDER.encode("ascii")
+
+MATCH_PRESETS: dict[str, tuple[str, ...]] = {
+    "default": ("args", "stdin", "iteration"),
+    "ignore_iteration": ("args", "stdin"),
+    "ignore_stdin": ("args", "iteration"),
+    "stdin_digest": ("args", "stdin_digest", "iteration"),
+}
+
+# A constant, a sequence to pick values from, or a function drawing values
+# from a random generator
+type Distribution[T] = T | Sequence[T] | Callable[[random.Random], T]
+
+_ARGS_SUBSET_RE = re.compile(r"args\[(-?\d*)(:?)(-?\d*)\]")
+
+
+@lru_cache(maxsize=1)
+def _yaml() -> tuple[Callable, Callable, type, type]:
+    """Import PyYAML on first use, with its C implementation if available.
+
+    Returns:
+        the load and dump functions, and the Loader and Dumper classes
+    """
+    from yaml import dump, load
+
+    try:
+        from yaml import CDumper as Dumper
+        from yaml import CLoader as Loader
+    except ImportError:
+        from yaml import Dumper, Loader
+
+    return load, dump, Loader, Dumper
+
 
+class StdinDigest:
+    """The SHA-256 digest of a stdin value, standing for it in recordings.
+
+    Digests are compared and hashed on their hex digest only, the raw
+    stdin value is kept only on demand.
+    """
+
+    __slots__ = ("sha256", "raw")
+
+    def __init__(self, sha256: str, raw: str | bytes | None = None) -> None:
+        self.sha256 = sha256
+        self.raw = raw
+
+    @classmethod
+    def of(
+        cls, stdin: "str | bytes | StdinDigest", keep: bool = False
+    ) -> "StdinDigest":
+        """Compute the digest of a stdin value.
+
+        Args:
+            stdin: a stdin value, str values are UTF-8 encoded
+            keep: if True, keep the raw stdin value in the digest
+
+        Returns:
+            a StdinDigest
+        """
+        if isinstance(stdin, StdinDigest):
+            return stdin
 
-def _encode_value(value: str | bytes | None) -> str | dict | None:
+        data = stdin.encode("utf-8") if isinstance(stdin, str) else stdin
+        return cls(hashlib.sha256(data).hexdigest(), stdin if keep else None)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, StdinDigest):
+            return NotImplemented
+        return self.sha256 == other.sha256
+
+    def __hash__(self) -> int:
+        return hash(self.sha256)
+
+    def __repr__(self) -> str:
+        return f"StdinDigest({self.sha256!r})"
+
+
+def _encode_value(value: str | bytes | StdinDigest | None) -> str | dict | None:
     """Encode a value for YAML serialization.
 
     Bytes are stored as base64-encoded strings wrapped in a dict
-    to distinguish them from regular strings.
+    to distinguish them from regular strings. Stdin digests are stored as
+    a dict of their hex digest and their raw value if kept.
     """
     if isinstance(value, bytes):
         return {"__base64__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, StdinDigest):
+        ret = {"__sha256__": value.sha256}
+        if value.raw is not None:
+            ret["raw"] = _encode_value(value.raw)
+        return ret
     return value
 
 
-def _decode_value(value: str | dict | None) -> str | bytes | None:
+def _decode_value(value: str | dict | None) -> str | bytes | StdinDigest | None:
     """Decode a value from YAML deserialization.
 
-    Detects base64-wrapped dicts and decodes them back to bytes.
+    Detects base64-wrapped dicts and decodes them back to bytes, and
+    digest dicts back to stdin digests.
     """
     if isinstance(value, dict) and "__base64__" in value:
         return base64.b64decode(value["__base64__"])
+    if isinstance(value, dict) and "__sha256__" in value:
+        return StdinDigest(value["__sha256__"], _decode_value(value.get("raw")))
     return value
 
 
+def _encode_args(
+    args: list[str | bytes] | str | bytes,
+) -> list[str | dict] | str | dict:
+    """Encode command line arguments, see _encode_value()."""
+    if isinstance(args, list | tuple):
+        return [_encode_value(arg) for arg in args]
+    return _encode_value(args)
+
+
+def _decode_args(
+    args: list[str | dict] | str | dict,
+) -> list[str | bytes] | str | bytes:
+    """Decode command line arguments, see _decode_value()."""
+    if isinstance(args, list):
+        return [_decode_value(arg) for arg in args]
+    return _decode_value(args)
+
+
+def _match_key(
+    args: list[str | bytes] | str | bytes,
+    stdin: str | bytes | StdinDigest | None,
+    iteration: int,
+) -> tuple:
+    """Build the hashable key identifying a recording.
+
+    Args:
+        args: a list of command line arguments, or a shell command string
+        stdin: an stdin value
+        iteration: an iteration number
+
+    Returns:
+        a tuple usable as a dictionnary key
+    """
+    if not isinstance(args, str | bytes):
+        args = tuple(args)
+
+    return (args, stdin, iteration)
+
+
+def _stdin_key(stdin: Any) -> Any:
+    """Return the SHA-256 hex digest standing for a stdin value in keys.
+
+    Other stdin values than str, bytes and digests, such as
+    subprocess.DEVNULL or a file, stand for themselves.
+    """
+    if not isinstance(stdin, str | bytes | StdinDigest):
+        return stdin
+
+    return StdinDigest.of(stdin).sha256
+
+
+def _short_stdin_key(stdin_key: Any) -> str:
+    """Describe a stdin key in messages, see _stdin_key()."""
+    if stdin_key is None:
+        return "none"
+    if isinstance(stdin_key, str):
+        return f"sha256:{stdin_key[:12]}"
+    return repr(stdin_key)
+
+
+@lru_cache(maxsize=1024)
+def _split_command(command: str) -> tuple[str, ...]:
+    """Split a shell command string into tokens.
+
+    Args:
+        command: a shell command string
+
+    Returns:
+        a tuple of tokens, or the whole command if it cannot be split
+    """
+    try:
+        return tuple(shlex.split(command))
+    except ValueError:
+        return (command,)
+
+
+# Whitespaces separating the tokens of shlex.split()
+_SHELL_WHITESPACE = " \t\r\n"
+
+
+@lru_cache(maxsize=1024)
+def _command_spans(command: str) -> tuple[tuple[int, int], ...] | None:
+    """Find the words of a shell command string.
+
+    Words are separated by unquoted whitespaces, like the tokens of
+    _split_command().
+
+    Args:
+        command: a shell command string
+
+    Returns:
+        the start and end offsets of each word, or None if the command
+        cannot be split
+    """
+    spans = []
+    start = None
+    quote = None
+    escaped = False
+    for i, c in enumerate(command):
+        if start is None:
+            if c in _SHELL_WHITESPACE:
+                continue
+            start = i
+
+        if escaped:
+            escaped = False
+        elif quote == "'":
+            if c == "'":
+                quote = None
+        elif c == "\\":
+            escaped = True
+        elif quote == '"':
+            if c == '"':
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c in _SHELL_WHITESPACE:
+            spans.append((start, i))
+            start = None
+
+    if quote is not None or escaped:
+        return None
+
+    if start is not None:
+        spans.append((start, len(command)))
+    return tuple(spans)
+
+
+def _args_tokens(args: tuple[str | bytes, ...] | str | bytes) -> tuple:
+    """Return the arguments of a match key as a tuple of tokens."""
+    if isinstance(args, str):
+        return _split_command(args)
+    if isinstance(args, bytes):
+        return (args,)
+    return args
+
+
+def _read_recordings(
+    path: Path, cache: "CassetteCache | None" = None
+) -> list[dict[str, Any]]:
+    """Read the encoded recordings stored in a recordings file.
+
+    Args:
+        path: a recordings file
+        cache: a cache of decoded recordings files
+
+    Returns:
+        a list of encoded recordings, empty if the file does not exist
+    """
+    return open_cassette(path, cache).read()
+
+
+def _entry_identity(entry: dict[str, Any]) -> str:
+    """Build the key identifying the slot of an encoded recording.
+
+    Args:
+        entry: an encoded recording
+
+    Returns:
+        a string usable as a dictionnary key
+    """
+    return json.dumps(
+        [
+            entry.get("args"),
+            entry.get("stdin"),
+            entry.get("iteration", 1),
+            entry.get("cwd"),
+            entry.get("env"),
+        ],
+        sort_keys=True,
+    )
+
+
+def _entry_key(entry: dict[str, Any]) -> str:
+    """Build the key identifying the command of an encoded recording.
+
+    Unlike _entry_identity(), the key does not include the iteration.
+
+    Args:
+        entry: an encoded recording
+
+    Returns:
+        a string
+    """
+    return json.dumps(
+        [entry.get("args"), entry.get("stdin"), entry.get("cwd"), entry.get("env")],
+        sort_keys=True,
+    )
+
+
+def recorded_duration(
+    path: "Path | Cassette", cache: "CassetteCache | None" = None
+) -> float | None:
+    """Return the total duration of the commands of a recordings file.
+
+    Args:
+        path: a recordings file or a Cassette
+        cache: a cache of decoded recordings files
+
+    Returns:
+        a duration in seconds, or None if the file has no recordings
+    """
+    if isinstance(path, Cassette):
+        recordings = path.read()
+    else:
+        recordings = _read_recordings(path, cache)
+    if not recordings:
+        return None
+
+    return sum(r.get("duration") or 0 for r in recordings) / 1000000
+
+
+class CassetteCache:
+    """On-disk cache of decoded recordings files.
+
+    Each recordings file is cached as a pickle named after its path, along
+    with the file modification time, size and the pvcr version it was
+    decoded with. A cached entry is only used while all of them are
+    unchanged, so processes sharing a cache directory skip YAML parsing.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        from importlib import metadata
+
+        self._dir = directory
+        try:
+            self._version = metadata.version("pytest-pvcr")
+        except metadata.PackageNotFoundError:
+            self._version = "unknown"
+
+    def _entry(self, path: Path) -> Path:
+        name = hashlib.sha256(str(path.absolute()).encode()).hexdigest()
+        return self._dir / f"{name}.pickle"
+
+    def _signature(self, path: Path) -> tuple | None:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+
+        return (stat.st_mtime_ns, stat.st_size, self._version)
+
+    def read(
+        self, path: Path, loader: Callable[[], list[dict[str, Any]]]
+    ) -> list[dict[str, Any]]:
+        """Read the encoded recordings of a recordings file.
+
+        Args:
+            path: a recordings file
+            loader: a function decoding the recordings file
+
+        Returns:
+            a list of encoded recordings, empty if the file does not exist
+        """
+        signature = self._signature(path)
+        if signature is None:
+            return []
+
+        try:
+            with self._entry(path).open("rb") as f:
+                if pickle.load(f) == signature:
+                    return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        recordings = loader()
+        self.store(path, recordings, signature)
+        return recordings
+
+    def store(
+        self,
+        path: Path,
+        recordings: list[dict[str, Any]],
+        signature: tuple | None = None,
+    ) -> None:
+        """Store the encoded recordings of a recordings file.
+
+        Args:
+            path: a recordings file
+            recordings: the encoded recordings the file holds
+            signature: the file signature, read from the file if None
+        """
+        signature = signature or self._signature(path)
+        if signature is None:
+            return
+
+        self._dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self._dir, delete=False) as f:
+            pickle.dump(signature, f)
+            pickle.dump(recordings, f)
+
+        os.replace(f.name, self._entry(path))
+        logger.debug("Cached recordings of %s", path)
+
+
+class Cassette:
+    """Storage backend of the recordings of a test.
+
+    Recordings are stored as encoded dictionnaries, see
+    Recording.to_encoded_dict(). Backends implement _read() and rewrite(),
+    and may override write() to store a single recording, exists() and
+    identity when they are not stored in their own file, read_recordings()
+    to skip decoding encoded recordings, and compact().
+    """
+
+    suffix: str
+
+    def __init__(self, path: Path, cache: CassetteCache | None = None) -> None:
+        self.path = path
+        self.modified = False
+        self._cache = cache
+
+    @property
+    def identity(self) -> Hashable:
+        """Return the key identifying this cassette among all cassettes."""
+        return self.path
+
+    def exists(self) -> bool:
+        """Return True if the cassette exists."""
+        return self.path.exists()
+
+    def read(self) -> list[dict[str, Any]]:
+        """Read the encoded recordings of this cassette.
+
+        Returns:
+            a list of encoded recordings, empty if the cassette does not exist
+        """
+        if self._cache is not None:
+            return self._cache.read(self.path, self._read)
+
+        return self._read()
+
+    def _read(self) -> list[dict[str, Any]]:
+        raise NotImplementedError
+
+    def read_recordings(self) -> list["Recording"]:
+        """Read the recordings of this cassette.
+
+        Returns:
+            a list of Recording, empty if the cassette does not exist
+        """
+        return [Recording.from_encoded_dict(entry) for entry in self.read()]
+
+    def written(self, recording: "Recording") -> "Recording":
+        """Return the recording kept in memory once written, see write().
+
+        Cassettes reading outputs on demand return a recording whose
+        outputs are read from the cassette.
+
+        Args:
+            recording: the Recording last written
+
+        Returns:
+            a Recording
+        """
+        return recording
+
+    def write(
+        self,
+        entry: dict[str, Any],
+        replace: Callable[[dict[str, Any]], bool] | None = None,
+    ) -> None:
+        """Write an encoded recording to this cassette.
+
+        Cassettes are rewritten with the new entry by default.
+
+        Args:
+            entry: an encoded recording
+            replace: a function selecting the encoded recording to replace,
+                the entry is added if None or if no recording is selected
+        """
+        recordings = self.read()
+
+        idx = len(recordings)
+        if replace is not None:
+            idx = next((i for i, r in enumerate(recordings) if replace(r)), idx)
+
+        recordings[idx : idx + 1] = [entry]
+        self.rewrite(recordings)
+
+    def rewrite(self, recordings: list[dict[str, Any]]) -> None:
+        """Replace all the recordings of this cassette.
+
+        Args:
+            recordings: a list of encoded recordings
+        """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Remove all the recordings of this cassette."""
+        self.rewrite([])
+
+    def compact(self) -> None:
+        """Rewrite this cassette in its canonical form."""
+
+
+class YamlCassette(Cassette):
+    """Cassette stored as a single YAML document."""
+
+    suffix = ".yaml"
+
+    def _read(self) -> list[dict[str, Any]]:
+        if not self.path.exists():
+            return []
+
+        load, _, Loader, _ = _yaml()
+        with self.path.open("r") as f:
+            data = load(f, Loader=Loader)
+
+        if not data:
+            return []
+
+        return data.get("recordings") or []
+
+    def rewrite(self, recordings: list[dict[str, Any]]) -> None:
+        _, dump, _, Dumper = _yaml()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("w+") as rf:
+            rf.write(dump({"recordings": recordings}, Dumper=Dumper))
+
+        self.modified = True
+        if self._cache is not None:
+            self._cache.store(self.path, recordings)
+
+
+class JournalCassette(Cassette):
+    """Append-only cassette stored as JSON lines.
+
+    Writing a recording appends a line to the file, so its cost does not
+    depend on the cassette size and an interrupted write only loses that
+    line. Later lines override earlier ones with the same args, stdin,
+    iteration, cwd and environment, and compact() rewrites the journal
+    without the overridden lines.
+    """
+
+    suffix = ".jsonl"
+
+    def _read(self) -> list[dict[str, Any]]:
+        if not self.path.exists():
+            return []
+
+        recordings = {}
+        with self.path.open("r") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(
+                        "Ignoring corrupted line %d of %s", line_no, self.path
+                    )
+                    continue
+
+                recordings[_entry_identity(entry)] = entry
+
+        return list(recordings.values())
+
+    def write(
+        self,
+        entry: dict[str, Any],
+        replace: Callable[[dict[str, Any]], bool] | None = None,
+    ) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(entry, separators=(",", ":")).encode() + b"\n"
+        with self.path.open("a+b") as f:
+            # Terminate a line left incomplete by an interrupted write
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+
+            f.write(line)
+
+        self.modified = True
+
+    def rewrite(self, recordings: list[dict[str, Any]]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=self.path.parent, delete=False) as f:
+            for entry in recordings:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+        os.replace(f.name, self.path)
+        self.modified = True
+
+    def compact(self) -> None:
+        if not self.path.exists():
+            return
+
+        self.rewrite(self._read())
+        logger.debug("Compacted %s", self.path)
+
+
+class CassetteBundle:
+    """Recordings of all the tests of a module, stored as one YAML document.
+
+    The document maps test ids to their encoded recordings. It is read on
+    first use and written once by save(), so a module costs a single file
+    read and write whatever its number of tests. Tests missing from the
+    bundle are migrated from their own recordings file, which is removed
+    when the bundle is saved.
+    """
+
+    suffix = ".yaml"
+
+    def __init__(self, path: Path, cache: CassetteCache | None = None) -> None:
+        self.path = path
+        self._cache = cache
+        self._tests: dict[str, list[dict[str, Any]]] | None = None
+        self._modified: set[str] = set()
+        self._migrated: set[Path] = set()
+
+    def _read(self) -> dict[str, list[dict[str, Any]]]:
+        if not self.path.exists():
+            return {}
+
+        load, _, Loader, _ = _yaml()
+        with self.path.open("r") as f:
+            data = load(f, Loader=Loader)
+
+        if not data:
+            return {}
+
+        return data.get("tests") or {}
+
+    def _load(self) -> dict[str, list[dict[str, Any]]]:
+        if self._tests is None:
+            if self._cache is not None:
+                self._tests = dict(self._cache.read(self.path, self._read))
+            else:
+                self._tests = self._read()
+
+        return self._tests
+
+    def cassette(self, test_id: str, legacy: Path | None = None) -> "BundledCassette":
+        """Return the cassette of a test of this bundle.
+
+        Args:
+            test_id: the test id, unique within the module
+            legacy: the recordings file of the test to migrate from
+
+        Returns:
+            a BundledCassette
+        """
+        return BundledCassette(self, test_id, legacy)
+
+    def test_ids(self) -> list[str]:
+        """Return the ids of the tests of this bundle."""
+        return list(self._load())
+
+    def get(self, test_id: str) -> list[dict[str, Any]] | None:
+        """Return the encoded recordings of a test, None if it has none."""
+        return self._load().get(test_id)
+
+    def set(self, test_id: str, recordings: list[dict[str, Any]]) -> None:
+        """Replace the encoded recordings of a test.
+
+        Args:
+            test_id: the test id
+            recordings: a list of encoded recordings
+        """
+        self._load()[test_id] = recordings
+        self._modified.add(test_id)
+
+    def migrate(self, test_id: str, legacy: Path) -> list[dict[str, Any]]:
+        """Import the recordings of a test from its own recordings file.
+
+        Args:
+            test_id: the test id
+            legacy: the recordings file of the test
+
+        Returns:
+            the imported encoded recordings
+        """
+        recordings = open_cassette(legacy, self._cache).read()
+        if recordings:
+            logger.debug("Migrating %s to %s", legacy, self.path)
+            self._load()[test_id] = recordings
+            self._migrated.add(legacy)
+
+        return recordings
+
+    def save(self) -> None:
+        """Write the modified tests recordings to the bundle file.
+
+        The bundle file is read again before being replaced, so concurrent
+        processes only override the recordings of the tests they modified.
+        """
+        if not self._modified:
+            return
+
+        tests = self._read()
+        for test_id in self._modified:
+            tests[test_id] = self._load()[test_id]
+
+        # Migrated tests are kept, their recordings file is removed
+        for test_id, recordings in self._load().items():
+            tests.setdefault(test_id, recordings)
+
+        _, dump, _, Dumper = _yaml()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=self.path.parent, delete=False) as f:
+            f.write(dump({"tests": tests}, Dumper=Dumper))
+
+        os.replace(f.name, self.path)
+        logger.debug("Saved %s", self.path)
+        if self._cache is not None:
+            self._cache.store(self.path, tests)
+
+        for legacy in self._migrated:
+            legacy.unlink(missing_ok=True)
+            with contextlib.suppress(OSError):
+                legacy.parent.rmdir()
+
+        self._tests = tests
+        self._modified.clear()
+        self._migrated.clear()
+
+
+class BundledCassette(Cassette):
+    """Cassette of a test stored in the cassette bundle of its module.
+
+    Recordings are only written to the bundle file when the bundle is saved.
+    """
+
+    suffix = CassetteBundle.suffix
+
+    def __init__(
+        self, bundle: CassetteBundle, test_id: str, legacy: Path | None = None
+    ) -> None:
+        super().__init__(bundle.path)
+        self.test_id = test_id
+        self._bundle = bundle
+        self._legacy = legacy
+
+    @property
+    def identity(self) -> Hashable:
+        return (self.path, self.test_id)
+
+    def exists(self) -> bool:
+        if self._bundle.get(self.test_id) is not None:
+            return True
+
+        return self._legacy is not None and self._legacy.exists()
+
+    def _read(self) -> list[dict[str, Any]]:
+        recordings = self._bundle.get(self.test_id)
+        if recordings is None and self._legacy is not None:
+            recordings = self._bundle.migrate(self.test_id, self._legacy)
+
+        return list(recordings or [])
+
+    def rewrite(self, recordings: list[dict[str, Any]]) -> None:
+        self._bundle.set(self.test_id, list(recordings))
+        self.modified = True
+
+
+class IndexedCassette(Cassette):
+    """Seekable cassette with a header offset table.
+
+    The file starts with a JSON header holding the head of each recording,
+    that is all its fields but its outputs, along with the byte range of
+    its outputs in the rest of the file. Reading the recordings of the
+    cassette only decodes the header, and the outputs of a recording are
+    read with a single seek on first access. Writing a recording rewrites
+    the file with the outputs of the other recordings copied as is, so that
+    they keep their byte range and are not decoded, and compact() drops the
+    replaced outputs.
+    """
+
+    suffix = ".pvcr"
+    magic = b"PVCR-INDEXED 1\n"
+
+    def __init__(self, path: Path, cache: CassetteCache | None = None) -> None:
+        super().__init__(path, cache)
+        self._lazy_recordings: weakref.WeakSet[LazyRecording] = weakref.WeakSet()
+        # Byte range of the outputs of the recording last written
+        self._written: list[int] | None = None
+
+    def _read_header(self, f: IO[bytes]) -> list[dict[str, Any]]:
+        if f.readline() != self.magic:
+            raise ValueError(f"Not an indexed cassette: {self.path}")
+
+        length = int(f.readline())
+        return json.loads(f.read(length))["recordings"]
+
+    def _read(self) -> list[dict[str, Any]]:
+        if not self.path.exists():
+            return []
+
+        with self.path.open("rb") as f:
+            heads = self._read_header(f)
+            payloads = f.read()
+
+        recordings = []
+        for head in heads:
+            entry = dict(head)
+            offset, length = entry.pop("payload")
+            entry.update(json.loads(payloads[offset : offset + length]))
+            recordings.append(entry)
+
+        return recordings
+
+    def read_recordings(self) -> list["Recording"]:
+        if not self.path.exists():
+            return []
+
+        with self.path.open("rb") as f:
+            heads = self._read_header(f)
+
+        recordings = [
+            LazyRecording(head, functools.partial(self._read_payload, *head["payload"]))
+            for head in heads
+        ]
+        self._lazy_recordings.update(recordings)
+        return recordings
+
+    def _read_payload(self, offset: int, length: int) -> dict[str, Any]:
+        with self.path.open("rb") as f:
+            if f.readline() != self.magic:
+                raise ValueError(f"Not an indexed cassette: {self.path}")
+
+            f.seek(int(f.readline()) + offset, os.SEEK_CUR)
+            return json.loads(f.read(length))
+
+    @staticmethod
+    def _split(entry: dict[str, Any]) -> tuple[dict[str, Any], bytes]:
+        """Split an encoded recording into its head and its encoded outputs."""
+        head = {k: v for k, v in entry.items() if k not in ("stdout", "stderr")}
+        payload = json.dumps(
+            {k: entry[k] for k in ("stdout", "stderr") if k in entry},
+            separators=(",", ":"),
+        ).encode()
+        return head, payload
+
+    def _write_file(self, heads: list[dict[str, Any]], payloads: list[bytes]) -> None:
+        header = json.dumps({"recordings": heads}, separators=(",", ":")).encode()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.path.parent, delete=False) as f:
+            f.write(self.magic)
+            f.write(b"%d\n" % len(header))
+            f.write(header)
+            f.writelines(payloads)
+
+        os.replace(f.name, self.path)
+        self.modified = True
+
+    def write(
+        self,
+        entry: dict[str, Any],
+        replace: Callable[[dict[str, Any]], bool] | None = None,
+    ) -> None:
+        self._written = None
+        # The cache stores whole encoded recordings
+        if self._cache is not None or not self.path.exists():
+            super().write(entry, replace)
+            return
+
+        with self.path.open("rb") as f:
+            heads = self._read_header(f)
+            payloads = f.read()
+
+        # Outputs replaced more than the live ones are dropped
+        live = sum(head["payload"][1] for head in heads)
+        if len(payloads) > 2 * live + 4096:
+            super().write(entry, replace)
+            return
+
+        head, payload = self._split(entry)
+        head["payload"] = [len(payloads), len(payload)]
+
+        idx = len(heads)
+        if replace is not None:
+            idx = next((i for i, h in enumerate(heads) if replace(h)), idx)
+
+        heads[idx : idx + 1] = [head]
+        self._write_file(heads, [payloads, payload])
+        self._written = head["payload"]
+
+    def written(self, recording: "Recording") -> "Recording":
+        if self._written is None:
+            return recording
+
+        lazy = LazyRecording.of(
+            recording, functools.partial(self._read_payload, *self._written)
+        )
+        self._lazy_recordings.add(lazy)
+        return lazy
+
+    def rewrite(self, recordings: list[dict[str, Any]]) -> None:
+        # Offsets of the recordings already read are about to change
+        for recording in list(self._lazy_recordings):
+            recording.detach()
+        self._lazy_recordings.clear()
+
+        heads = []
+        payloads = []
+        offset = 0
+        for entry in recordings:
+            head, payload = self._split(entry)
+            head["payload"] = [offset, len(payload)]
+            offset += len(payload)
+            heads.append(head)
+            payloads.append(payload)
+
+        self._write_file(heads, payloads)
+        if self._cache is not None:
+            self._cache.store(self.path, recordings)
+
+    def compact(self) -> None:
+        if not self.path.exists():
+            return
+
+        self.rewrite(self._read())
+        logger.debug("Compacted %s", self.path)
+
+
+class SqliteDatabase:
+    """SQLite database storing the cassettes of a whole recordings tree.
+
+    Cassettes are named after the path of their recordings file relative
+    to the database directory, without suffix. Recordings are indexed on
+    their cassette name, command key and iteration, and their outputs are
+    stored as is, text or BLOB, without base64. The database uses WAL
+    journaling so concurrent pytest workers read while one of them writes.
+    """
+
+    suffix = ".sqlite3"
+
+    def __init__(self, path: Path) -> None:
+        import sqlite3
+
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS recordings (
+                    cassette TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    iteration INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    head TEXT NOT NULL,
+                    stdout BLOB,
+                    stderr BLOB,
+                    PRIMARY KEY (cassette, key, iteration)
+                )"""
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS recordings_position "
+                "ON recordings (cassette, position)"
+            )
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        self.connection.close()
+
+    def name(self, path: Path) -> str:
+        """Return the name of the cassette of a recordings file.
+
+        Args:
+            path: a recordings file
+
+        Returns:
+            the path of the file relative to the database directory,
+            without suffix
+        """
+        name = os.path.relpath(path.with_suffix(""), self.path.parent)
+        return Path(name).as_posix()
+
+    def cassette(self, name: str) -> "SqliteCassette":
+        """Return a cassette of the database.
+
+        Args:
+            name: a cassette name, see name()
+
+        Returns:
+            a SqliteCassette
+        """
+        return SqliteCassette(self, name)
+
+    def names(self) -> list[str]:
+        """Return the names of the cassettes of the database."""
+        rows = self.connection.execute(
+            "SELECT DISTINCT cassette FROM recordings ORDER BY cassette"
+        )
+        return [name for (name,) in rows]
+
+    def import_cassettes(self, paths: Iterable[Path]) -> int:
+        """Import recordings files into the database.
+
+        The cassettes of the files replace the ones with the same name.
+
+        Args:
+            paths: recordings files
+
+        Returns:
+            the number of imported recordings
+        """
+        count = 0
+        for path in paths:
+            recordings = open_cassette(path).read()
+            self.cassette(self.name(path)).rewrite(recordings)
+            count += len(recordings)
+
+        return count
+
+    def export_cassettes(self, directory: Path | None = None) -> list[Path]:
+        """Export the cassettes of the database to YAML recordings files.
+
+        Args:
+            directory: the directory cassette names are relative to,
+                default to the database directory
+
+        Returns:
+            the written recordings files
+        """
+        directory = directory or self.path.parent
+        paths = []
+        for name in self.names():
+            path = directory / f"{name}{YamlCassette.suffix}"
+            YamlCassette(path).rewrite(self.cassette(name).read())
+            paths.append(path)
+
+        return paths
+
+
+class SqliteCassette(Cassette):
+    """Cassette stored in a SqliteDatabase.
+
+    Its path is the database path followed by the cassette name, so that it
+    identifies the cassette in messages.
+    """
+
+    suffix = SqliteDatabase.suffix
+
+    def __init__(self, database: SqliteDatabase, name: str) -> None:
+        super().__init__(database.path / name)
+        self.database = database
+        self.name = name
+
+    def _rows(self) -> list[tuple[str, Any, Any]]:
+        return self.database.connection.execute(
+            "SELECT head, stdout, stderr FROM recordings "
+            "WHERE cassette = ? ORDER BY position",
+            (self.name,),
+        ).fetchall()
+
+    def exists(self) -> bool:
+        row = self.database.connection.execute(
+            "SELECT 1 FROM recordings WHERE cassette = ? LIMIT 1", (self.name,)
+        ).fetchone()
+        return row is not None
+
+    def _read(self) -> list[dict[str, Any]]:
+        recordings = []
+        for head, stdout, stderr in self._rows():
+            entry = json.loads(head)
+            if stdout is not None:
+                entry["stdout"] = _encode_value(stdout)
+            if stderr is not None:
+                entry["stderr"] = _encode_value(stderr)
+            recordings.append(entry)
+
+        return recordings
+
+    def read(self) -> list[dict[str, Any]]:
+        return self._read()
+
+    def read_recordings(self) -> list["Recording"]:
+        recordings = []
+        for head, stdout, stderr in self._rows():
+            recording = Recording.from_encoded_dict(json.loads(head))
+            recording.stdout = stdout
+            recording.stderr = stderr
+            recordings.append(recording)
+
+        return recordings
+
+    def _row(self, entry: dict[str, Any], position: int) -> tuple:
+        head = {k: v for k, v in entry.items() if k not in ("stdout", "stderr")}
+        return (
+            self.name,
+            _entry_key(entry),
+            entry.get("iteration", 1),
+            position,
+            json.dumps(head, separators=(",", ":")),
+            _decode_value(entry.get("stdout")),
+            _decode_value(entry.get("stderr")),
+        )
+
+    def write(
+        self,
+        entry: dict[str, Any],
+        replace: Callable[[dict[str, Any]], bool] | None = None,
+    ) -> None:
+        """Write an encoded recording to this cassette.
+
+        The recording replaces the one with the same command and iteration,
+        or the one selected by replace, which is only given the recordings
+        without their outputs.
+        """
+        connection = self.database.connection
+        with connection:
+            replaced = connection.execute(
+                "SELECT position FROM recordings "
+                "WHERE cassette = ? AND key = ? AND iteration = ?",
+                (self.name, _entry_key(entry), entry.get("iteration", 1)),
+            ).fetchone()
+
+            if replaced is None and replace is not None:
+                rows = connection.execute(
+                    "SELECT key, iteration, position, head FROM recordings "
+                    "WHERE cassette = ? ORDER BY position",
+                    (self.name,),
+                ).fetchall()
+                for key, iteration, position, head in rows:
+                    if replace(json.loads(head)):
+                        connection.execute(
+                            "DELETE FROM recordings "
+                            "WHERE cassette = ? AND key = ? AND iteration = ?",
+                            (self.name, key, iteration),
+                        )
+                        replaced = (position,)
+                        break
+
+            if replaced is None:
+                replaced = connection.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM recordings "
+                    "WHERE cassette = ?",
+                    (self.name,),
+                ).fetchone()
+
+            connection.execute(
+                "INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._row(entry, replaced[0]),
+            )
+
+        self.modified = True
+
+    def rewrite(self, recordings: list[dict[str, Any]]) -> None:
+        connection = self.database.connection
+        with connection:
+            connection.execute(
+                "DELETE FROM recordings WHERE cassette = ?", (self.name,)
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._row(entry, i) for i, entry in enumerate(recordings)],
+            )
+
+        self.modified = True
+
+
+CASSETTE_FORMATS: dict[str, type[Cassette]] = {
+    "yaml": YamlCassette,
+    "journal": JournalCassette,
+    "indexed": IndexedCassette,
+}
+
+
+def open_cassette(path: Path, cache: CassetteCache | None = None) -> Cassette:
+    """Open the cassette stored in a recordings file.
+
+    The cassette format is selected from the file suffix, YAML by default.
+
+    Args:
+        path: a recordings file
+        cache: a cache of decoded recordings files
+
+    Returns:
+        a Cassette
+    """
+    for cassette_cls in CASSETTE_FORMATS.values():
+        if path.suffix == cassette_cls.suffix:
+            return cassette_cls(path, cache)
+
+    return YamlCassette(path, cache)
+
+
+class ResourceUsage(NamedTuple):
+    """The resources used by an executed command.
+
+    Args:
+        utime: the user CPU time in seconds
+        stime: the system CPU time in seconds
+        maxrss: the maximum resident set size in KiB
+    """
+
+    utime: float
+    stime: float
+    maxrss: int
+
+
+# Exceptions of executed commands recorded and raised again when replayed
+RECORDED_EXCEPTIONS = (TimeoutExpired, FileNotFoundError, PermissionError)
+
+
+def encode_exception(exception: BaseException) -> dict[str, Any]:
+    """Encode an exception raised by an executed command.
+
+    The outputs collected before a timeout are recorded as the outputs of
+    the command and are not part of the encoded exception.
+
+    Args:
+        exception: one of RECORDED_EXCEPTIONS
+
+    Returns:
+        a dictionnary
+    """
+    if isinstance(exception, TimeoutExpired):
+        return {"type": "TimeoutExpired", "timeout": exception.timeout}
+
+    filename = exception.filename
+    if isinstance(filename, bytes):
+        filename = os.fsdecode(filename)
+    return {
+        "type": type(exception).__name__,
+        "errno": exception.errno,
+        "strerror": exception.strerror,
+        "filename": filename,
+    }
+
+
+def decode_exception(
+    data: dict[str, Any],
+    args: list[str | bytes] | str | bytes,
+    stdout: str | bytes | None = None,
+    stderr: str | bytes | None = None,
+) -> BaseException:
+    """Build a new exception from an encoded one.
+
+    Args:
+        data: an encoded exception, see encode_exception()
+        args: the command line arguments of the command
+        stdout: the outputs collected before a timeout
+        stderr: the errors collected before a timeout
+
+    Returns:
+        an exception
+    """
+    if data["type"] == "TimeoutExpired":
+        return TimeoutExpired(args, data["timeout"], output=stdout, stderr=stderr)
+
+    # OSError() builds the subclass matching the errno
+    return OSError(data["errno"], data["strerror"], data["filename"])
+
+
+def _decode_usage(value: dict[str, Any] | None) -> ResourceUsage | None:
+    """Decode the resource usage of an encoded recording."""
+    if value is None:
+        return None
+    return ResourceUsage(value["utime"], value["stime"], value["maxrss"])
+
+
+def _convert_output(
+    value: str | bytes | None, text: bool, encoding: str | None, errors: str | None
+) -> str | bytes | None:
+    """Convert a recorded output to a text or binary mode output.
+
+    See Recording.outputs().
+    """
+    if value is None or isinstance(value, str) == text:
+        return value
+
+    encoding = encoding or locale.getencoding()
+    errors = errors or "strict"
+    if text:
+        # See subprocess.Popen._translate_newlines()
+        return value.decode(encoding, errors).replace("\r\n", "\n").replace("\r", "\n")
+
+    return value.encode(encoding, errors)
+
+
 class Recording:
-    args: list[str | bytes]
-    stdin: str | bytes | None
-    stdout: str | bytes | None
-    stderr: str | bytes | None
+    """A recorded command.
+
+    Recordings are identified by their args, stdin and iteration number.
+    The match key built from these fields and its hash are computed once
+    and refreshed only when one of them is changed.
+    """
+
+    __slots__ = (
+        "_args",
+        "_stdin",
+        "_iteration",
+        "_key",
+        "_hash",
+        "_stdout",
+        "_stderr",
+        "_converted",
+        "rc",
+        "duration",
+        "cwd",
+        "env",
+        "usage",
+        "exception",
+        "saved",
+    )
+
     rc: int | None
     duration: int | None
-    iteration: int
+    cwd: str | None
+    env: dict[str, str | None] | None
+    usage: ResourceUsage | None
+    exception: dict[str, Any] | None
     saved: bool
 
     def __init__(
         self,
-        args: list[str | bytes],
-        stdin: str | bytes | None = None,
+        args: list[str | bytes] | str | bytes,
+        stdin: str | bytes | StdinDigest | None = None,
         stdout: str | bytes | None = None,
         stderr: str | bytes | None = None,
         rc: int | None = None,
         duration: int | None = None,
         iteration: int = 1,
         saved: bool = False,
+        cwd: str | None = None,
+        env: dict[str, str | None] | None = None,
+        usage: ResourceUsage | None = None,
+        exception: dict[str, Any] | None = None,
     ):
-        self.args = args
-        self.stdin = stdin
-        self.stdout = stdout
-        self.stderr = stderr
+        self._args = args
+        self._stdin = stdin
+        self._iteration = iteration
+        self._update_key()
+        self._converted = None
+        self._stdout = stdout
+        self._stderr = stderr
         self.rc = rc
         self.duration = duration
-        self.iteration = iteration
+        self.cwd = cwd
+        self.env = env
+        self.usage = usage
+        self.exception = exception
         self.saved = saved
 
+    def _update_key(self) -> None:
+        self._key = _match_key(self._args, self._stdin, self._iteration)
+        self._hash = hash(self._key)
+
+    @property
+    def args(self) -> list[str | bytes] | str | bytes:
+        return self._args
+
+    @args.setter
+    def args(self, value: list[str | bytes] | str | bytes) -> None:
+        self._args = value
+        self._update_key()
+
+    @property
+    def stdin(self) -> str | bytes | StdinDigest | None:
+        return self._stdin
+
+    @stdin.setter
+    def stdin(self, value: str | bytes | StdinDigest | None) -> None:
+        self._stdin = value
+        self._update_key()
+
+    @property
+    def iteration(self) -> int:
+        return self._iteration
+
+    @iteration.setter
+    def iteration(self, value: int) -> None:
+        self._iteration = value
+        self._update_key()
+
+    @property
+    def key(self) -> tuple:
+        """Return the match key of this recording."""
+        return self._key
+
+    @property
+    def stdout(self) -> str | bytes | None:
+        return self._stdout
+
+    @stdout.setter
+    def stdout(self, value: str | bytes | None) -> None:
+        self._stdout = value
+        self._converted = None
+
+    @property
+    def stderr(self) -> str | bytes | None:
+        return self._stderr
+
+    @stderr.setter
+    def stderr(self, value: str | bytes | None) -> None:
+        self._stderr = value
+        self._converted = None
+
+    def outputs(
+        self, text: bool, encoding: str | None = None, errors: str | None = None
+    ) -> tuple[str | bytes | None, str | bytes | None]:
+        """Return the outputs of this recording in a text or binary mode.
+
+        Outputs are stored once, as they were recorded. Binary outputs are
+        decoded for text mode callers the way subprocess does, and text
+        outputs are encoded for binary mode callers. Converted outputs are
+        cached until the outputs of the recording change.
+
+        Args:
+            text: True for the outputs of a text mode caller
+            encoding: the caller encoding, default to the locale encoding
+            errors: the caller error handler, default to "strict"
+
+        Returns:
+            the stdout and stderr of this recording
+        """
+        stdout = self.stdout
+        stderr = self.stderr
+        if all(v is None or isinstance(v, str) == text for v in (stdout, stderr)):
+            return stdout, stderr
+
+        mode = (text, encoding, errors)
+        if self._converted is None:
+            self._converted = {}
+        converted = self._converted.get(mode)
+        if converted is None:
+            converted = (
+                _convert_output(stdout, text, encoding, errors),
+                _convert_output(stderr, text, encoding, errors),
+            )
+            self._converted[mode] = converted
+
+        return converted
+
     def to_encoded_dict(self) -> dict[str, Any]:
         """Generate a dictionnary with this record data.
 
@@ -76,7 +1470,7 @@ class Recording:
             a dictionnary
         """
         ret = {
-            "args": self.args,
+            "args": _encode_args(self.args),
             "rc": self.rc,
             "duration": self.duration,
             "iteration": self.iteration,
@@ -91,6 +1485,18 @@ class Recording:
         if self.stderr is not None:
             ret["stderr"] = _encode_value(self.stderr)
 
+        if self.cwd is not None:
+            ret["cwd"] = self.cwd
+
+        if self.env is not None:
+            ret["env"] = self.env
+
+        if self.usage is not None:
+            ret["usage"] = self.usage._asdict()
+
+        if self.exception is not None:
+            ret["exception"] = self.exception
+
         return ret
 
     @classmethod
@@ -103,46 +1509,43 @@ class Recording:
         Returns:
             a Recording
         """
-        ret = Recording(
-            data.get("args", []),
+        return cls(
+            _decode_args(data.get("args", [])),
+            stdin=_decode_value(data.get("stdin")),
+            stdout=_decode_value(data.get("stdout")),
+            stderr=_decode_value(data.get("stderr")),
             rc=data.get("rc"),
+            duration=data.get("duration"),
             iteration=data.get("iteration", 1),
+            cwd=data.get("cwd"),
+            env=data.get("env"),
+            usage=_decode_usage(data.get("usage")),
+            exception=data.get("exception"),
         )
 
-        if "stdin" in data:
-            ret.stdin = _decode_value(data.get("stdin"))
-
-        if "stdout" in data:
-            ret.stdout = _decode_value(data.get("stdout"))
-
-        if "stderr" in data:
-            ret.stderr = _decode_value(data.get("stderr"))
-
-        if "rc" in data:
-            ret.rc = data.get("rc")
-
-        if "duration" in data:
-            ret.duration = data.get("duration")
-
-        return ret
-
     def copy(self, other: "Recording") -> None:
         """Copy a Recording into this one.
 
         Args:
             other: another Recording
         """
-        self.args = other.args
-        self.stdin = other.stdin
+        self._args = other._args
+        self._stdin = other._stdin
+        self._iteration = other._iteration
+        self._key = other._key
+        self._hash = other._hash
         self.stdout = other.stdout
         self.stderr = other.stderr
         self.rc = other.rc
-        self.iteration = other.iteration
         self.duration = other.duration
+        self.cwd = other.cwd
+        self.env = other.env
+        self.usage = other.usage
+        self.exception = other.exception
 
     def match(
         self,
-        args: list[str],
+        args: list[str] | str,
         stdin: str | None = None,
         iteration: int | None = None,
     ) -> bool:
@@ -156,11 +1559,10 @@ class Recording:
         Returns:
             True if this recording match args, stdin and iteration number
         """
-        return (
-            self.args == args
-            and self.stdin == stdin
-            and (iteration is None or self.iteration == iteration)
-        )
+        if iteration is None:
+            iteration = self._iteration
+
+        return self._key == _match_key(args, stdin, iteration)
 
     def __eq__(self, other: object) -> bool:
         """Compare two recordings.
@@ -173,22 +1575,455 @@ class Recording:
         """
         if not isinstance(other, Recording):
             return NotImplemented
-        return self.match(other.args, other.stdin, other.iteration)
+        return self._hash == other._hash and self._key == other._key
+
+    def __hash__(self) -> int:
+        return self._hash
+
+
+class LazyRecording(Recording):
+    """A recording whose outputs are read from its cassette on first access.
+
+    The outputs read can be released, to be read again on next access.
+
+    Args:
+        head: an encoded recording without its outputs
+        load: a function returning the encoded outputs of the recording
+    """
+
+    __slots__ = ("_load", "_source", "__weakref__")
+
+    def __init__(
+        self, head: dict[str, Any], load: Callable[[], dict[str, Any]]
+    ) -> None:
+        self._load = None
+        super().__init__(
+            _decode_args(head.get("args", [])),
+            stdin=_decode_value(head.get("stdin")),
+            rc=head.get("rc"),
+            duration=head.get("duration"),
+            iteration=head.get("iteration", 1),
+            cwd=head.get("cwd"),
+            env=head.get("env"),
+            usage=_decode_usage(head.get("usage")),
+            exception=head.get("exception"),
+        )
+        self._load = load
+        self._source = load
+
+    @classmethod
+    def of(
+        cls, recording: Recording, load: Callable[[], dict[str, Any]]
+    ) -> "LazyRecording":
+        """Build a recording of the head of another recording.
+
+        Args:
+            recording: a Recording
+            load: a function returning the encoded outputs of the recording
+
+        Returns:
+            a LazyRecording
+        """
+        lazy = cls.__new__(cls)
+        lazy._load = None
+        lazy._source = None
+        Recording.__init__(
+            lazy,
+            recording.args,
+            stdin=recording.stdin,
+            rc=recording.rc,
+            duration=recording.duration,
+            iteration=recording.iteration,
+            saved=recording.saved,
+            cwd=recording.cwd,
+            env=recording.env,
+            usage=recording.usage,
+            exception=recording.exception,
+        )
+        lazy._load = load
+        lazy._source = load
+        return lazy
+
+    def materialize(self) -> None:
+        """Read the outputs of this recording if they were not read yet."""
+        load = self._load
+        if load is None:
+            return
+
+        self._load = None
+        payload = load()
+        Recording.stdout.__set__(self, _decode_value(payload.get("stdout")))
+        Recording.stderr.__set__(self, _decode_value(payload.get("stderr")))
+
+    def detach(self) -> None:
+        """Read the outputs of this recording and never read them again."""
+        self.materialize()
+        self._source = None
+
+    def release(self) -> None:
+        """Release the outputs read, unless they were modified or detached."""
+        if self._load is not None or self._source is None:
+            return
+
+        Recording.stdout.__set__(self, None)
+        Recording.stderr.__set__(self, None)
+        self._load = self._source
+
+    @property
+    def stdout(self) -> str | bytes | None:
+        self.materialize()
+        return Recording.stdout.__get__(self)
+
+    @stdout.setter
+    def stdout(self, value: str | bytes | None) -> None:
+        self.detach()
+        Recording.stdout.__set__(self, value)
+
+    @property
+    def stderr(self) -> str | bytes | None:
+        self.materialize()
+        return Recording.stderr.__get__(self)
+
+    @stderr.setter
+    def stderr(self, value: str | bytes | None) -> None:
+        self.detach()
+        Recording.stderr.__set__(self, value)
+
+
+def _field_getter(field: str) -> Callable[["Recording"], Any]:
+    """Build the function extracting a match field from a recording.
+
+    Args:
+        field: a match field name
+
+    Returns:
+        a function returning the field value of a recording
+    """
+    if field == "args":
+        return lambda r: r.key[0]
+    if field == "stdin":
+        return lambda r: r.key[1]
+    if field == "stdin_digest":
+        return lambda r: _stdin_key(r.key[1])
+    if field == "iteration":
+        return lambda r: r.key[2]
+    if field == "cwd":
+        return lambda r: r.cwd
+    if field.startswith("env:"):
+        name = field[4:]
+        return lambda r: (r.env or {}).get(name)
+
+    subset = _ARGS_SUBSET_RE.fullmatch(field)
+    if subset is None:
+        raise ValueError(f"Unknown match field: {field}")
+
+    start, colon, stop = subset.groups()
+    if not colon:
+        index = int(start)
+        return lambda r: _args_tokens(r.key[0])[index : index + 1 or None]
+
+    args_slice = slice(int(start) if start else None, int(stop) if stop else None)
+    return lambda r: _args_tokens(r.key[0])[args_slice]
+
+
+class MatchStrategy:
+    """Select the fields a command line is matched on.
+
+    A strategy is either a preset name from MATCH_PRESETS or a list of
+    fields among "args", "args[i]" or "args[i:j]" for a subset of the
+    arguments, "stdin", "stdin_digest" for the SHA-256 digest of stdin,
+    "iteration", "cwd" and "env:NAME" for the value of an environment
+    variable. Recordings are indexed on these fields so
+    a lookup is a single dictionnary access.
+    """
+
+    __slots__ = ("fields", "cwd", "stdin_digest", "env_keys", "_getters")
+
+    def __init__(self, fields: str | Iterable[str] = "default") -> None:
+        if isinstance(fields, str):
+            if fields not in MATCH_PRESETS:
+                raise ValueError(f"Unknown match strategy: {fields}")
+            fields = MATCH_PRESETS[fields]
+
+        self.fields = tuple(fields)
+        self.cwd = "cwd" in self.fields
+        self.stdin_digest = "stdin_digest" in self.fields
+        self.env_keys = tuple(f[4:] for f in self.fields if f.startswith("env:"))
+        self._getters = tuple(_field_getter(f) for f in self.fields)
+
+    def key(self, recording: "Recording") -> tuple:
+        """Build the index key of a recording.
+
+        Args:
+            recording: a Recording
+
+        Returns:
+            a tuple of the recording's values for this strategy's fields
+        """
+        return tuple(getter(recording) for getter in self._getters)
+
+    def without_iteration(self) -> "MatchStrategy":
+        """Return this strategy without the iteration field."""
+        return MatchStrategy(f for f in self.fields if f != "iteration")
+
+    def counting(self) -> "MatchStrategy":
+        """Return the strategy counting the occurences of a command line.
+
+        It is this strategy without the iteration and stdin fields, the
+        digest of stdin being computed once by the counter, see
+        Recordings.append().
+        """
+        return MatchStrategy(
+            f
+            for f in self.without_iteration().fields
+            if f not in ("stdin", "stdin_digest")
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MatchStrategy):
+            return NotImplemented
+        return self.fields == other.fields
+
+    def __hash__(self) -> int:
+        return hash(self.fields)
+
+    def __repr__(self) -> str:
+        return f"MatchStrategy({list(self.fields)!r})"
+
+
+class NearMiss(NamedTuple):
+    """A recorded command close to an unrecorded one.
+
+    The difference names the match field differing from the unrecorded
+    command when their arguments are the same.
+    """
+
+    recording: "Recording"
+    similarity: float
+    difference: str | None = None
+
+
+class Replay(NamedTuple):
+    """A pre-built replay result."""
+
+    process: CompletedProcess
+    duration: float | None
+    exception: dict[str, Any] | None = None
+    recording: Recording | None = None
+
+
+def _replay(recording: Recording) -> Replay:
+    """Build the replay result of a recording."""
+    return Replay(
+        CompletedProcess(
+            recording.args,
+            returncode=recording.rc,
+            stdout=recording.stdout,
+            stderr=recording.stderr,
+        ),
+        recording.duration,
+        recording.exception,
+        recording,
+    )
+
+
+class ReplayTable:
+    """Immutable lookup table of pre-built replay results.
+
+    A table is compiled once from a recordings file and maps the match key
+    of every recording to a pre-built CompletedProcess, so replaying a
+    command is a single dictionnary lookup. Replayed processes are copies of
+    the pre-built ones, see wrapper._replay_or_execute(). Recordings whose outputs are
+    read on demand are kept as is and only read when replayed.
+    """
+
+    __slots__ = ("_entries",)
+
+    def __init__(self, entries: dict[tuple, Replay | Recording]) -> None:
+        object.__setattr__(self, "_entries", MappingProxyType(dict(entries)))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @classmethod
+    def from_file(
+        cls,
+        path: Path,
+        match_strategy: MatchStrategy | None = None,
+        cache: CassetteCache | None = None,
+    ) -> "ReplayTable":
+        """Compile a recordings file into a replay table.
+
+        Args:
+            path: a recordings file
+            match_strategy: the strategy to index recordings on
+            cache: a cache of decoded recordings files
+
+        Returns:
+            a ReplayTable, empty if the file does not exist
+        """
+        return cls.from_cassette(open_cassette(path, cache), match_strategy)
+
+    @classmethod
+    def from_cassette(
+        cls, cassette: Cassette, match_strategy: MatchStrategy | None = None
+    ) -> "ReplayTable":
+        """Compile the recordings of a cassette into a replay table.
+
+        Args:
+            cassette: a Cassette
+            match_strategy: the strategy to index recordings on
+
+        Returns:
+            a ReplayTable, empty if the cassette does not exist
+        """
+        match_strategy = match_strategy or MatchStrategy()
+        entries = {}
+        for recording in cassette.read_recordings():
+            key = match_strategy.key(recording)
+            if key in entries:
+                continue
+
+            # Outputs read on demand are only read when replayed
+            if isinstance(recording, LazyRecording):
+                entries[key] = recording
+            else:
+                entries[key] = _replay(recording)
+
+        return cls(entries)
+
+    def get(self, key: tuple) -> Replay | None:
+        """Get the replay result for a match key.
+
+        Args:
+            key: a match key
+
+        Returns:
+            a Replay, or None if the key is not recorded
+        """
+        entry = self._entries.get(key)
+        if isinstance(entry, Recording):
+            return _replay(entry)
+
+        return entry
+
+
+def _compile_fuzzy_matcher(
+    pattern: str,
+) -> tuple[re.Pattern[str], re.Pattern[bytes] | None]:
+    """Compile a fuzzy matcher regex for str and bytes arguments.
+
+    Args:
+        pattern: a regex
+
+    Returns:
+        the str regex, and the bytes regex or None if the regex has no
+        bytes equivalent
+    """
+    str_re = re.compile(pattern)
+    try:
+        bytes_re = re.compile(pattern.encode("utf-8"))
+    except re.error:
+        bytes_re = None
+
+    return str_re, bytes_re
+
+
+def _fuzzy_arg[T: (str, bytes)](
+    arg: T, matchers: list[re.Pattern[T]], placeholder: T
+) -> T:
+    """Add fuzzy matching to an arg.
+
+    Fuzzy matching is accomplished by replacing some regex or
+    non-matching part of some regex with a placeholder string.
+
+    Args:
+        arg: a str or bytes arg
+        matchers: regexes of the same type as arg
+        placeholder: the placeholder of the same type as arg
+
+    Returns:
+        a fuzzy matchable arg
+    """
+    for f_re in matchers:
+        # If the regex has match group, we replace all the
+        # matched part with the placeholder. Otherwise, the
+        # non-matching parts are replaced and the matched
+        # parts are kept.
+        if f_re.groups == 0:
+            arg = f_re.sub(placeholder, arg)
+            continue
+
+        f_match = f_re.fullmatch(arg)
+        if not f_match:
+            continue
+
+        arg_len = len(arg)
+        arg = placeholder.join(f_match.groups())
+
+        # Add a placeholder if the first matching part is not at the start
+        if f_match.start(1) > 0:
+            arg = placeholder + arg
+
+        # Add a placeholder if the last matching part is not at the end
+        if f_match.end(f_match.lastindex) < arg_len:
+            arg = arg + placeholder
+
+    return arg
 
 
 class Recordings:
     def __init__(
         self,
-        recordings_file: Path,
+        recordings_file: Path | Cassette,
         record_mode: str,
         fuzzy_matchers: list[str] | None = None,
+        replay_table: ReplayTable | None = None,
+        match_strategy: MatchStrategy | None = None,
+        cache: CassetteCache | None = None,
+        keep_stdin: bool = False,
     ) -> None:
-        self._file = recordings_file
+        if isinstance(recordings_file, Cassette):
+            self._cassette = recordings_file
+        else:
+            self._cassette = open_cassette(recordings_file, cache)
+        self._file = self._cassette.path
         self._mode = record_mode
-        self._fuzzy_matchers = [re.compile(m) for m in (fuzzy_matchers or [])]
-        self._file_existed_at_init = recordings_file.exists()
+        compiled = [_compile_fuzzy_matcher(m) for m in (fuzzy_matchers or [])]
+        self._fuzzy_matchers = [str_re for str_re, _ in compiled]
+        self._fuzzy_bytes_matchers = [b_re for _, b_re in compiled if b_re is not None]
+        self._file_existed_at_init = self._cassette.exists()
+        self._replay_table = replay_table
+        self._strategy = match_strategy or MatchStrategy()
+        self._keep_stdin = keep_stdin
+        self._count_strategy = self._strategy.counting()
+        self._count_stdin = len(self._count_strategy.fields) < len(
+            self._strategy.without_iteration().fields
+        )
 
-        self._history = []
+        # Number of occurences of each (args, stdin digest) key
+        self._history: dict[tuple, int] = {}
+        self._iterations: dict[tuple, int] = {}
+        # Recordings of the file by match key, the outputs of the recordings
+        # read on demand are released once returned
+        self._index: dict[tuple, Recording] | None = None
+        self._tokens_index: dict[Any, list[int]] | None = None
+        self._commands: list[tuple[Recording, int]] = []
+        # Number of iterations recorded by args and stdin digest
+        self._variants: dict[Any, dict[Any, int]] = {}
+        # Match keys of the recordings added with add()
+        self._added_keys: set[tuple] = set()
+
+    @property
+    def record_mode(self) -> str:
+        """Return the record mode."""
+        return self._mode
 
     @property
     def block_unrecorded(self) -> bool:
@@ -206,20 +2041,21 @@ class Recordings:
             stdin: an stdin value
 
         Returns:
-            A list of recordings matching args and stdin
+            A list of recordings matching args and stdin, without their
+            results
         """
-        ret = []
-        for recording in self._history:
-            if recording.match(args, stdin):
-                ret.append(recording)
+        args_key, _, _ = _match_key(args, stdin, 1)
+        count = self._history.get((args_key, _stdin_key(stdin)), 0)
+        if isinstance(args, tuple):
+            args = list(args)
 
-        return ret
+        return [Recording(args, stdin, iteration=i) for i in range(1, count + 1)]
 
-    def _fuzzy_compiler(self, args: list[str | bytes]) -> list[str]:
+    def _fuzzy_compiler(self, args: Iterable[str | bytes]) -> list[str | bytes]:
         """Add fuzzy matching to a list or args.
 
-        Fuzzy matching is accomplished by replacing some regex or
-        non-matching part of some regex with a placeholder string.
+        str and bytes args are matched natively against the str and bytes
+        flavors of the fuzzy matchers, other args are converted to str.
 
         Args:
             args: a list of args
@@ -229,37 +2065,278 @@ class Recordings:
         """
         f_args = []
         for arg in args:
-            f_arg = str(arg)
-
-            for f_re in self._fuzzy_matchers:
-                # If the regex has match group, we replace all the
-                # matched part with the placeholder. Otherwise, the
-                # non-matching parts are replaced and the matched
-                # parts are kept.
-                if f_re.groups == 0:
-                    f_arg = f_re.sub(FUZZY_PLACEHOLDER, f_arg)
-                    continue
+            if isinstance(arg, bytes):
+                f_arg = _fuzzy_arg(
+                    arg, self._fuzzy_bytes_matchers, FUZZY_PLACEHOLDER_BYTES
+                )
+            else:
+                f_arg = _fuzzy_arg(str(arg), self._fuzzy_matchers, FUZZY_PLACEHOLDER)
+
+            f_args.append(f_arg)
+
+        return f_args
+
+    def _fuzzy_command(
+        self, args: list[str | bytes] | str | bytes
+    ) -> list[str | bytes] | str | bytes:
+        """Add fuzzy matching to a command.
+
+        Shell command strings are split into tokens to apply fuzzy matching
+        to each token, and are kept as a single string.
+
+        Args:
+            args: a list of args, or a shell command string
+
+        Returns:
+            a fuzzy matchable list of args or shell command string
+        """
+        if isinstance(args, bytes):
+            return self._fuzzy_compiler([args])[0]
+
+        if not isinstance(args, str):
+            return self._fuzzy_compiler(args)
+
+        if not self._fuzzy_matchers:
+            return args
+
+        # The command could not be split
+        spans = _command_spans(args)
+        if spans is None:
+            return self._fuzzy_compiler([args])[0]
+
+        # Only the fuzzy matched words are replaced, so that the shell syntax
+        # of the command is kept
+        parts = []
+        position = 0
+        for start, end in spans:
+            word = args[start:end]
+            (token,) = shlex.split(word) or ("",)
+            (f_token,) = self._fuzzy_compiler([token])
+            if f_token == token:
+                continue
+
+            parts.append(args[position:start])
+            parts.append(f_token if word == token else shlex.quote(f_token))
+            position = end
+
+        if not parts:
+            return args
+
+        parts.append(args[position:])
+        return "".join(parts)
 
-                f_match = f_re.fullmatch(f_arg)
-                if not f_match:
+    def _new_recording(
+        self,
+        args: list[str] | str,
+        stdin: str | None,
+        cwd: str | os.PathLike | None,
+        env: dict[str, str] | None,
+    ) -> Recording:
+        """Build a fuzzy matchable recording of a command line.
+
+        The working directory and environment are only kept if the match
+        strategy keys on them. If the strategy keys on the stdin digest, the
+        stdin value is replaced by its digest, and only kept in it if
+        keep_stdin is set.
+
+        Args:
+            args: a list of command line arguments
+            stdin: an stdin value
+            cwd: the command working directory, None for the current one
+            env: the command environment, None for the current one
+
+        Returns:
+            a Recording
+        """
+        if self._strategy.stdin_digest and isinstance(stdin, str | bytes):
+            stdin = StdinDigest.of(stdin, self._keep_stdin)
+
+        recording = Recording(self._fuzzy_command(args), stdin)
+
+        if self._strategy.cwd:
+            cwd = os.getcwd() if cwd is None else os.fspath(cwd)
+            recording.cwd = self._fuzzy_compiler([cwd])[0]
+
+        if self._strategy.env_keys:
+            env = os.environ if env is None else env
+            recording.env = {
+                k: self._fuzzy_compiler([env[k]])[0] if k in env else None
+                for k in self._strategy.env_keys
+            }
+
+        return recording
+
+    def _count_key(self, recording: Recording, stdin_key: Any) -> tuple:
+        """Build the key counting the occurences of a fuzzy command line.
+
+        Args:
+            recording: a fuzzy matchable Recording
+            stdin_key: the digest of its stdin, see _stdin_key()
+
+        Returns:
+            a hashable key
+        """
+        key = self._count_strategy.key(recording)
+        if self._count_stdin:
+            return (stdin_key, *key)
+        return key
+
+    def _next_iteration(self, recording: Recording, stdin_key: Any) -> int:
+        """Count a new occurence of a fuzzy command line.
+
+        Args:
+            recording: a fuzzy matchable Recording
+            stdin_key: the digest of its stdin, see _stdin_key()
+
+        Returns:
+            the iteration number of this occurence
+        """
+        key = self._count_key(recording, stdin_key)
+        iteration = self._iterations.get(key, 0) + 1
+        self._iterations[key] = iteration
+        return iteration
+
+    def _get_index(self) -> dict[tuple, Recording]:
+        """Return the recordings of the file indexed by match key.
+
+        The recordings file is read on first use only.
+        """
+        if self._index is None:
+            self._index = {}
+            for recording in self._cassette.read_recordings():
+                self._index.setdefault(self._strategy.key(recording), recording)
+
+        return self._index
+
+    def _get_tokens_index(self) -> dict[Any, list[int]]:
+        """Return the recorded commands indexed by argument token.
+
+        The index maps each token to the positions in self._commands of the
+        distinct recorded commands holding it, along with the stdin digests
+        and iterations recorded for their args. It is built on first use from
+        the recordings file index.
+        """
+        if self._tokens_index is None:
+            self._tokens_index = {}
+            self._commands = []
+            self._variants = {}
+            for recording in self._get_index().values():
+                args_key = recording.key[0]
+                variants = self._variants.get(args_key)
+                stdin_key = _stdin_key(recording.stdin)
+                if variants is not None:
+                    variants[stdin_key] = max(
+                        variants.get(stdin_key, 0), recording.iteration
+                    )
                     continue
 
-                f_arg_len = len(f_arg)
-                f_arg = FUZZY_PLACEHOLDER.join(f_match.groups())
+                self._variants[args_key] = {stdin_key: recording.iteration}
+                tokens = set(_args_tokens(args_key))
+                for token in tokens:
+                    self._tokens_index.setdefault(token, []).append(len(self._commands))
+                # Only the command line is kept, not the outputs
+                command = Recording(recording.args, iteration=recording.iteration)
+                self._commands.append((command, len(tokens)))
 
-                # Add a placeholder if the first matching part is not at the start
-                if f_match.start(1) > 0:
-                    f_arg = f"{FUZZY_PLACEHOLDER}{f_arg}"
+        return self._tokens_index
 
-                # Add a placeholder if the last matching part is not at the end
-                if f_match.end(f_match.lastindex) < f_arg_len:
-                    f_arg = f"{f_arg}{FUZZY_PLACEHOLDER}"
+    def near_misses(self, recording: Recording, limit: int = 3) -> list[NearMiss]:
+        """Find the recorded commands closest to an unrecorded one.
 
-            f_args.append(f_arg)
+        Commands are ranked by the Jaccard similarity of their fuzzy
+        argument tokens. Only the recorded commands sharing a token with the
+        unrecorded one are scored, through an inverted index of tokens.
 
-        return f_args
+        Args:
+            recording: a fuzzy matchable Recording, see append()
+            limit: the maximum number of commands returned
+
+        Returns:
+            a list of NearMiss, the most similar first
+        """
+        tokens_index = self._get_tokens_index()
+        tokens = set(_args_tokens(recording.key[0]))
+
+        shared: dict[int, int] = {}
+        for token in tokens:
+            for position in tokens_index.get(token, ()):
+                shared[position] = shared.get(position, 0) + 1
+
+        ret = []
+        for position, count in shared.items():
+            o_recording, size = self._commands[position]
+            difference = None
+            if o_recording.key[0] == recording.key[0]:
+                difference = self._difference(recording)
+            ret.append(
+                NearMiss(o_recording, count / (len(tokens) + size - count), difference)
+            )
+
+        return heapq.nlargest(limit, ret, key=lambda near_miss: near_miss.similarity)
+
+    def _difference(self, recording: Recording) -> str:
+        """Name why an unrecorded command misses the recordings of its args.
+
+        Args:
+            recording: a fuzzy matchable Recording, see append()
+
+        Returns:
+            a description of the difference
+        """
+        variants = self._variants[recording.key[0]]
+        stdin_key = _stdin_key(recording.stdin)
+        if self._count_stdin and stdin_key not in variants:
+            recorded = ", ".join(_short_stdin_key(key) for key in variants)
+            return (
+                f"stdin {_short_stdin_key(stdin_key)} differs from recorded {recorded}"
+            )
+
+        if "iteration" in self._strategy.fields:
+            iterations = variants.get(stdin_key, 0)
+            if recording.iteration > iterations:
+                times = "once" if iterations == 1 else f"{iterations} times"
+                return f"call {recording.iteration} with this stdin, recorded {times}"
+
+        return "other match fields differ"
+
+    def replay(
+        self,
+        args: list[str] | str,
+        stdin: str | None = None,
+        cwd: str | os.PathLike | None = None,
+        env: dict[str, str] | None = None,
+    ) -> Replay | None:
+        """Replay a command line from the replay table.
+
+        Args:
+            args: a list of command line arguments
+            stdin: an stdin value
+            cwd: the command working directory
+            env: the command environment
+
+        Returns:
+            a Replay, or None if there is no replay table or the command
+            line is not recorded in it
+        """
+        if self._replay_table is None:
+            return None
+
+        recording = self._new_recording(args, stdin, cwd, env)
+        key = self._count_key(recording, _stdin_key(recording.stdin))
+        recording.iteration = self._iterations.get(key, 0) + 1
+        replay = self._replay_table.get(self._strategy.key(recording))
+        if replay is not None:
+            self._iterations[key] = recording.iteration
+
+        return replay
 
-    def append(self, args: list[str], stdin: str | None = None) -> Recording:
+    def append(
+        self,
+        args: list[str] | str,
+        stdin: str | None = None,
+        cwd: str | os.PathLike | None = None,
+        env: dict[str, str] | None = None,
+    ) -> Recording:
         """Append a command line to this list of recordings.
 
         Fill the recording with saved data if a recording matching
@@ -268,21 +2345,25 @@ class Recordings:
         Args:
             args: a list of command line arguments
             stdin: an stdin value
+            cwd: the command working directory
+            env: the command environment
 
         Returns:
             The new Recording object
         """
-        # Fuzzy matching
-        f_args = self._fuzzy_compiler(args)
+        new_recording = self._new_recording(args, stdin, cwd, env)
+        stdin_key = _stdin_key(new_recording.stdin)
+        new_recording.iteration = self._next_iteration(new_recording, stdin_key)
 
-        new_recording = Recording(f_args, stdin)
-        new_recording.iteration = len(self.find_all(f_args, stdin)) + 1
-        self.load(new_recording)
+        # The replay table already holds every recording of the file
+        if self._replay_table is None:
+            self.load(new_recording)
 
-        if self._mode == "all":
+        if self._mode == "all" and new_recording.key not in self._added_keys:
             new_recording.saved = False
 
-        self._history.append(new_recording)
+        history_key = (new_recording.key[0], stdin_key)
+        self._history[history_key] = self._history.get(history_key, 0) + 1
 
         return new_recording
 
@@ -292,22 +2373,120 @@ class Recordings:
         Args:
             recording: a Recording to load.
         """
-        if not self._file.exists():
-            return
+        key = self._strategy.key(recording)
+        o_recording = self._get_index().get(key)
+        if o_recording is not None:
+            logger.debug("Loaded recording from %s: %s", self._file, recording.args)
+            recording.copy(o_recording)
+            recording.saved = True
 
-        with self._file.open("r") as f:
-            data = load(f, Loader=Loader)
+            # Outputs read with a seek are read again on demand
+            if isinstance(o_recording, LazyRecording):
+                o_recording.release()
 
-        if not data or not data.get("recordings", []):
-            return
+    def add(self, recordings: Iterable[Recording]) -> list[Recording]:
+        """Add recordings replayed from memory, without writing them.
+
+        Added recordings are fuzzy matchable like appended ones, replace the
+        recordings with the same match key, and are replayed in every
+        record mode. The replay table of these recordings is dropped, so
+        that added recordings take precedence over the recordings file.
+
+        Args:
+            recordings: Recordings of command lines, with their results
+
+        Returns:
+            the added Recordings
+        """
+        index = self._get_index()
+        self._replay_table = None
+        self._tokens_index = None
+
+        ret = []
+        for recording in recordings:
+            added = self._new_recording(
+                recording.args, recording.stdin, recording.cwd, recording.env
+            )
+            added.iteration = recording.iteration
+            added.stdout = recording.stdout
+            added.stderr = recording.stderr
+            added.rc = recording.rc
+            added.duration = recording.duration
+            added.exception = recording.exception
+            added.saved = True
+
+            index[self._strategy.key(added)] = added
+            self._added_keys.add(added.key)
+            ret.append(added)
+
+        logger.debug("Added %d recordings to %s", len(ret), self._file)
+        return ret
 
-        for s_recording in data.get("recordings", []):
-            o_recording = Recording.from_encoded_dict(s_recording)
-            if recording == o_recording:
-                logger.debug("Loaded recording from %s: %s", self._file, recording.args)
-                recording.copy(o_recording)
-                recording.saved = True
-                break
+    def synthesize(
+        self,
+        args: list[str] | str | Callable[[int], list[str] | str],
+        count: int,
+        rc: Distribution[int] = 0,
+        size: Distribution[int] = 0,
+        duration: Distribution[float] = 0,
+        seed: int | None = None,
+    ) -> list[Recording]:
+        """Add synthetic recordings replayed from memory, see add().
+
+        The command line of the i-th recording is built by formatting each
+        argument of a template with i, or by calling a function with i.
+        Identical command lines are recorded as successive iterations. The
+        return code, stdout size in bytes and duration in microseconds of
+        each recording are constants, picked from a sequence, or drawn by a
+        function from a random generator, such as lambda r: r.expovariate(1).
+
+        Args:
+            args: a command line template, or a function building the
+                command line of a recording from its number
+            count: the number of recordings
+            rc: the distribution of the return codes
+            size: the distribution of the stdout sizes
+            duration: the distribution of the durations
+            seed: the seed of the random generator
+
+        Returns:
+            the added Recordings
+        """
+        rng = random.Random(seed)
+
+        def sample[T](distribution: Distribution[T]) -> T:
+            if callable(distribution):
+                return distribution(rng)
+            if isinstance(distribution, Sequence):
+                return rng.choice(distribution)
+            return distribution
+
+        iterations: dict[tuple, int] = {}
+        recordings = []
+        for i in range(count):
+            if callable(args):
+                command = args(i)
+            elif isinstance(args, str):
+                command = args.format(i=i)
+            else:
+                command = [arg.format(i=i) for arg in args]
+
+            key = _match_key(command, None, 1)
+            iterations[key] = iterations.get(key, 0) + 1
+
+            stdout_size = sample(size)
+            recordings.append(
+                Recording(
+                    command,
+                    stdout=b"x" * (stdout_size - 1) + b"\n" if stdout_size else b"",
+                    stderr=b"",
+                    rc=sample(rc),
+                    duration=sample(duration),
+                    iteration=iterations[key],
+                )
+            )
+
+        return self.add(recordings)
 
     def write(self, recording: Recording) -> None:
         """Write recordings's data to the recordings file.
@@ -326,33 +2505,25 @@ class Recordings:
             )
             return
 
-        if not self._file.parent.exists():
-            self._file.parent.mkdir(parents=True)
+        key = self._strategy.key(recording)
 
-        data = {}
-        if self._file.exists():
-            with self._file.open("r") as f:
-                data = load(f, Loader=Loader)
-
-        if data is None or "recordings" not in data:
-            data = {"recordings": []}
-
-        idx = 0
-        for r_idx in range(len(data.get("recordings"))):
-            o_recording = Recording.from_encoded_dict(data["recordings"][r_idx])
-            if recording != o_recording:
-                continue
+        replace = None
+        if self._mode == "all":
+            identity = (key, recording.iteration)
 
-            if self._mode == "all":
-                idx = r_idx
-                break
-        else:
-            idx = len(data.get("recordings"))
+            def replace(entry: dict[str, Any]) -> bool:
+                o_recording = Recording.from_encoded_dict(entry)
+                return identity == (
+                    self._strategy.key(o_recording),
+                    o_recording.iteration,
+                )
 
-        data["recordings"][idx : idx + 1] = [recording.to_encoded_dict()]
+        self._cassette.write(recording.to_encoded_dict(), replace)
 
-        with self._file.open("w+") as rf:
-            rf.write(dump(data, Dumper=Dumper))
+        index = self._get_index()
+        if self._mode == "all" or key not in index:
+            index[key] = self._cassette.written(recording)
+            self._tokens_index = None
 
         logger.debug("Wrote recording to %s: %s", self._file, recording.args)
         recording.saved = True
@@ -363,10 +2534,21 @@ class Recordings:
         Args:
             write: if True, also clean the recordings file.
         """
-        self._history = []
+        self._history = {}
+        self._iterations = {}
 
         if not write:
             return
 
-        with self._file.open("w+") as rf:
-            rf.write(dump({"recordings": []}, Dumper=Dumper))
+        self._index = {}
+        self._tokens_index = None
+        self._cassette.clear()
+
+    @property
+    def cassette(self) -> Cassette:
+        """Return the cassette storing these recordings."""
+        return self._cassette
+
+    def compact(self) -> None:
+        """Rewrite the recordings file in its canonical form."""
+        self._cassette.compact()
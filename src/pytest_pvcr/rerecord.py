@@ -0,0 +1,240 @@
+import logging
+import os
+import subprocess
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from .recordings import (
+    CASSETTE_FORMATS,
+    FUZZY_PLACEHOLDER,
+    FUZZY_PLACEHOLDER_BYTES,
+    Cassette,
+    CassetteBundle,
+    Recording,
+    StdinDigest,
+    open_cassette,
+)
+from .wrapper import measure_execution
+
+logger = logging.getLogger("pvcr")
+
+
+class Change(NamedTuple):
+    """A recorded command whose result changed when re-executed."""
+
+    path: Path
+    args: list[str | bytes]
+    iteration: int
+    fields: tuple[str, ...]
+
+
+class Skip(NamedTuple):
+    """A recorded command that could not be re-executed."""
+
+    path: Path
+    args: list[str | bytes]
+    iteration: int
+    reason: str
+
+
+def find_cassettes(paths: Iterable[Path]) -> list[Path]:
+    """Find the recordings files in a list of paths.
+
+    Args:
+        paths: recordings files, or directories searched recursively for
+            recordings files stored in a "recordings" directory
+
+    Returns:
+        a sorted list of recordings files
+    """
+    suffixes = {cassette_cls.suffix for cassette_cls in CASSETTE_FORMATS.values()}
+
+    ret = set()
+    for path in paths:
+        if path.is_file():
+            ret.add(path)
+            continue
+
+        for candidate in path.rglob("*"):
+            if (
+                candidate.suffix in suffixes
+                and "recordings" in candidate.parent.parts
+                and candidate.is_file()
+            ):
+                ret.add(candidate)
+
+    return sorted(ret)
+
+
+def _execute(recording: Recording, timeout: float | None) -> None:
+    """Execute a recorded command and update the recording with its result.
+
+    Args:
+        recording: a Recording
+        timeout: a timeout in seconds
+    """
+    env = None
+    if recording.env:
+        env = dict(os.environ)
+        for name, value in recording.env.items():
+            if value is None:
+                env.pop(name, None)
+            else:
+                env[name] = value
+
+    stdin = recording.stdin
+    if isinstance(stdin, StdinDigest):
+        stdin = stdin.raw
+
+    text = any(
+        isinstance(value, str) for value in (stdin, recording.stdout, recording.stderr)
+    )
+
+    ret, duration, usage = measure_execution(
+        recording.args,
+        stdin,
+        timeout,
+        cwd=recording.cwd,
+        env=env,
+        shell=isinstance(recording.args, str | bytes),
+        text=text,
+    )
+    recording.stdout = ret.stdout
+    recording.stderr = ret.stderr
+    recording.rc = ret.returncode
+    recording.duration = duration
+    recording.usage = usage
+    recording.exception = None
+
+
+def _rerecord(
+    cassette: Cassette, timeout: float | None, dry_run: bool
+) -> tuple[list[Change], list[Skip]]:
+    """Re-execute the commands of a cassette in order.
+
+    Args:
+        cassette: a Cassette
+        timeout: a timeout in seconds for each command
+        dry_run: if True, do not update the cassette
+
+    Returns:
+        the list of changed commands and the list of skipped commands
+    """
+    path = cassette.path
+    changes = []
+    skips = []
+    recordings = []
+    for entry in cassette.read():
+        recording = Recording.from_encoded_dict(entry)
+        recordings.append(recording)
+
+        args = recording.args
+        if isinstance(args, str | bytes):
+            args = [args]
+
+        if any(
+            (FUZZY_PLACEHOLDER_BYTES if isinstance(arg, bytes) else FUZZY_PLACEHOLDER)
+            in arg
+            for arg in args
+        ):
+            skips.append(
+                Skip(path, recording.args, recording.iteration, "fuzzy arguments")
+            )
+            continue
+
+        if isinstance(recording.stdin, StdinDigest) and recording.stdin.raw is None:
+            skips.append(
+                Skip(
+                    path, recording.args, recording.iteration, "stdin stored as digest"
+                )
+            )
+            continue
+
+        before = (recording.stdout, recording.stderr, recording.rc)
+        try:
+            _execute(recording, timeout)
+        except (OSError, subprocess.SubprocessError) as e:
+            skips.append(Skip(path, recording.args, recording.iteration, str(e)))
+            continue
+
+        after = (recording.stdout, recording.stderr, recording.rc)
+        fields = tuple(
+            name
+            for name, old, new in zip(
+                ("stdout", "stderr", "rc"), before, after, strict=True
+            )
+            if old != new
+        )
+        if fields:
+            changes.append(Change(path, recording.args, recording.iteration, fields))
+
+    if not dry_run:
+        cassette.rewrite([recording.to_encoded_dict() for recording in recordings])
+        logger.debug("Re-recorded %s", path)
+
+    return changes, skips
+
+
+def rerecord_cassette(
+    path: Path,
+    timeout: float | None = None,
+    dry_run: bool = False,
+) -> tuple[list[Change], list[Skip]]:
+    """Re-execute the commands of a recordings file in order.
+
+    Args:
+        path: a recordings file or a module cassette bundle
+        timeout: a timeout in seconds for each command
+        dry_run: if True, do not update the recordings file
+
+    Returns:
+        the list of changed commands and the list of skipped commands
+    """
+    bundle = None
+    cassettes = [open_cassette(path)]
+    if path.suffix == CassetteBundle.suffix:
+        bundle = CassetteBundle(path)
+        test_ids = bundle.test_ids()
+        if test_ids:
+            cassettes = [bundle.cassette(test_id) for test_id in test_ids]
+
+    changes = []
+    skips = []
+    for cassette in cassettes:
+        cassette_changes, cassette_skips = _rerecord(cassette, timeout, dry_run)
+        changes.extend(cassette_changes)
+        skips.extend(cassette_skips)
+
+    if bundle is not None and not dry_run:
+        bundle.save()
+
+    return changes, skips
+
+
+def rerecord(
+    paths: Iterable[Path],
+    jobs: int | None = None,
+    timeout: float | None = None,
+    dry_run: bool = False,
+) -> Iterator[tuple[list[Change], list[Skip]]]:
+    """Re-execute the commands of recordings files in parallel.
+
+    Recordings files are processed concurrently by at most jobs workers,
+    while the commands of each file are executed in their recorded order.
+
+    Args:
+        paths: recordings files or directories, see find_cassettes()
+        jobs: the maximum number of commands executed concurrently
+        timeout: a timeout in seconds for each command
+        dry_run: if True, do not update the recordings files
+
+    Returns:
+        an iterator of the changed and skipped commands of each file
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(
+            lambda path: rerecord_cassette(path, timeout, dry_run),
+            find_cassettes(paths),
+        )
@@ -0,0 +1,199 @@
+import hashlib
+import time
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from .recordings import Recording, YamlCassette, _yaml, open_cassette
+from .rerecord import find_cassettes
+
+
+class Payload(NamedTuple):
+    """An output of a recorded command."""
+
+    test: str
+    args: list[str | bytes] | str | bytes
+    iteration: int
+    stream: str
+    size: int
+    sha256: str
+
+
+class CassetteStats(NamedTuple):
+    """Statistics of a recordings file."""
+
+    path: Path
+    size: int
+    entries: int
+    parse_time: float
+    tests: dict[str, tuple[int, float]]
+    payloads: list[Payload]
+
+
+def _read_tests(path: Path) -> dict[str, list[dict[str, Any]]]:
+    """Read the encoded recordings of the tests of a recordings file.
+
+    Args:
+        path: a recordings file or a module cassette bundle
+
+    Returns:
+        the encoded recordings by test name
+    """
+    cassette = open_cassette(path)
+    if not isinstance(cassette, YamlCassette):
+        return {str(path): cassette.read()}
+
+    # Parse the document once and tell a test recordings file from a module
+    # cassette bundle by its top-level key
+    load, _, Loader, _ = _yaml()
+    with path.open("r") as f:
+        data = load(f, Loader=Loader) or {}
+
+    if "tests" in data and "recordings" not in data:
+        return {
+            f"{path}::{test_id}": recordings or []
+            for test_id, recordings in (data["tests"] or {}).items()
+        }
+
+    return {str(path): data.get("recordings") or []}
+
+
+def cassette_stats(path: Path) -> CassetteStats:
+    """Compute the statistics of a recordings file.
+
+    Args:
+        path: a recordings file or a module cassette bundle
+
+    Returns:
+        a CassetteStats
+    """
+    before = time.perf_counter()
+    tests = _read_tests(path)
+    parse_time = time.perf_counter() - before
+
+    entries = 0
+    durations = {}
+    payloads = []
+    for test, recordings in tests.items():
+        entries += len(recordings)
+        durations[test] = (
+            len(recordings),
+            sum(entry.get("duration") or 0 for entry in recordings) / 1000000,
+        )
+
+        for entry in recordings:
+            recording = Recording.from_encoded_dict(entry)
+            for stream, value in (
+                ("stdout", recording.stdout),
+                ("stderr", recording.stderr),
+            ):
+                if not value:
+                    continue
+
+                if isinstance(value, str):
+                    value = value.encode()
+                payloads.append(
+                    Payload(
+                        test,
+                        recording.args,
+                        recording.iteration,
+                        stream,
+                        len(value),
+                        hashlib.sha256(value).hexdigest(),
+                    )
+                )
+
+    return CassetteStats(
+        path, path.stat().st_size, entries, parse_time, durations, payloads
+    )
+
+
+def _payload_dict(payload: Payload) -> dict[str, Any]:
+    """Convert a payload to a JSON serializable dictionnary."""
+    args = payload.args
+    if isinstance(args, bytes):
+        args = repr(args)
+    elif isinstance(args, list):
+        args = [repr(arg) if isinstance(arg, bytes) else arg for arg in args]
+
+    return {
+        "test": payload.test,
+        "args": args,
+        "iteration": payload.iteration,
+        "stream": payload.stream,
+        "size": payload.size,
+    }
+
+
+def stats(
+    paths: Iterable[Path], jobs: int | None = None, top: int = 10
+) -> dict[str, Any]:
+    """Compute the statistics of recordings files in parallel.
+
+    Recordings files are decoded concurrently by at most jobs processes.
+
+    Args:
+        paths: recordings files or directories, see find_cassettes()
+        jobs: the maximum number of files decoded concurrently
+        top: the number of largest and duplicate payloads reported
+
+    Returns:
+        a JSON serializable dictionnary with the statistics of every
+        recordings file and test, sorted by decreasing parse time and
+        duration, the top largest payloads, the top duplicate payloads by
+        wasted size, and the totals
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        cassettes = list(executor.map(cassette_stats, find_cassettes(paths)))
+
+    tests = []
+    payloads = []
+    for cassette in cassettes:
+        payloads.extend(cassette.payloads)
+        for test, (entries, duration) in cassette.tests.items():
+            tests.append({"test": test, "entries": entries, "duration": duration})
+
+    duplicates: dict[str, list[Payload]] = {}
+    for payload in payloads:
+        duplicates.setdefault(payload.sha256, []).append(payload)
+
+    duplicate_payloads = [
+        {
+            "sha256": sha256,
+            "size": copies[0].size,
+            "count": len(copies),
+            "wasted": copies[0].size * (len(copies) - 1),
+            "payloads": [_payload_dict(copy) for copy in copies],
+        }
+        for sha256, copies in duplicates.items()
+        if len(copies) > 1
+    ]
+    duplicate_payloads.sort(key=lambda duplicate: duplicate["wasted"], reverse=True)
+
+    largest_payloads = sorted(payloads, key=lambda payload: payload.size, reverse=True)
+
+    return {
+        "totals": {
+            "files": len(cassettes),
+            "size": sum(cassette.size for cassette in cassettes),
+            "entries": sum(cassette.entries for cassette in cassettes),
+            "duration": sum(test["duration"] for test in tests),
+            "parse_time": sum(cassette.parse_time for cassette in cassettes),
+            "duplicate_size": sum(d["wasted"] for d in duplicate_payloads),
+        },
+        "cassettes": [
+            {
+                "path": str(cassette.path),
+                "size": cassette.size,
+                "entries": cassette.entries,
+                "parse_time": cassette.parse_time,
+            }
+            for cassette in sorted(
+                cassettes, key=lambda cassette: cassette.parse_time, reverse=True
+            )
+        ],
+        "tests": sorted(tests, key=lambda test: test["duration"], reverse=True),
+        "largest_payloads": [_payload_dict(p) for p in largest_payloads[:top]],
+        "duplicate_payloads": duplicate_payloads[:top],
+    }
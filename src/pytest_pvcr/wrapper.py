@@ -1,47 +1,405 @@
 from __future__ import annotations
 
+import functools
+import io
 import logging
+import os
+import re
+import shlex
 import subprocess
 import sys
+import threading
 import time
-from typing import TYPE_CHECKING, Any
+from collections.abc import Callable, Iterable
+from typing import IO, TYPE_CHECKING, Any, NoReturn
 
 logger = logging.getLogger("pvcr")
 
 if TYPE_CHECKING:
-    from .recordings import Recordings
+    from .recordings import Recording, Recordings, ResourceUsage
 
 
 class PVCRBlockedRunException(Exception): ...
 
 
-def install_wrapper() -> None:
+# Functions replaced by install_wrapper() and patch_subprocess()
+_orig_run = subprocess.run
+_orig_execute_child = subprocess.Popen._execute_child
+_orig_try_wait = getattr(subprocess.Popen, "_try_wait", None)
+_orig_system = os.system
+_orig_popen = os.popen
+
+# Set while pvcr executes a command live, with the resources it used
+_live = threading.local()
+
+# Attributes bound to a wrapper by install_wrapper() and patch_subprocess(),
+# with their original value
+_rebound_modules: list[tuple[Any, str, Any]] = []
+
+
+def install_wrapper(modules: Iterable[str] = ()) -> None:
+    """Install the subprocess wrapper.
+
+    The os.system() and os.popen() functions are replaced as well.
+
+    Args:
+        modules: names of already imported modules whose globals bound to
+            the subprocess module or to a replaced os function are rebound
+            to their wrapper
+    """
     sys.modules["subprocess"] = SubprocessWrapper
 
+    os.system = system
+    os.popen = popen
+
+    # Resource usage is only available from os.wait4()
+    if _orig_try_wait is not None and hasattr(os, "wait4"):
+        _rebound_modules.append((subprocess.Popen, "_try_wait", _orig_try_wait))
+        subprocess.Popen._try_wait = _try_wait
+
+    # Wrappers by id of the object they replace
+    wrappers = {
+        id(SubprocessWrapper.pvcr_orig_cls): (
+            SubprocessWrapper.pvcr_orig_cls,
+            SubprocessWrapper,
+        ),
+        id(_orig_system): (_orig_system, system),
+        id(_orig_popen): (_orig_popen, popen),
+    }
+    for name in modules:
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+
+        for attr, value in list(vars(module).items()):
+            replaced = wrappers.get(id(value))
+            if replaced is not None and replaced[0] is value:
+                setattr(module, attr, replaced[1])
+                _rebound_modules.append((module, attr, value))
+
+
+@functools.wraps(_orig_run)
+def _patched_run(*args: Any, **kwargs: Any) -> subprocess.CompletedProcess:
+    if SubprocessWrapper.pvcr_enabled:
+        return run(*args, **kwargs)
+    return _orig_run(*args, **kwargs)
+
+
+def _execute_child(self: subprocess.Popen, args: Any, *other_args: Any) -> None:
+    if SubprocessWrapper.pvcr_enabled and not getattr(_live, "executing", False):
+        SubprocessWrapper.pvcr_bypassed += 1
+        logger.warning("Live execution bypassing pvcr: %s", args)
+
+    _orig_execute_child(self, args, *other_args)
+
+
+def _try_wait(self: subprocess.Popen, wait_flags: int) -> tuple[int, int]:
+    if not getattr(_live, "executing", False):
+        return _orig_try_wait(self, wait_flags)
+
+    try:
+        pid, sts, rusage = os.wait4(self.pid, wait_flags)
+    except ChildProcessError:
+        # See subprocess.Popen._try_wait()
+        return (self.pid, 0)
+
+    if pid:
+        # ru_maxrss is in bytes on macOS and in KiB elsewhere
+        maxrss = rusage.ru_maxrss
+        if sys.platform == "darwin":
+            maxrss //= 1024
+        _live.usage = (rusage.ru_utime, rusage.ru_stime, maxrss)
+    return (pid, sts)
+
+
+def patch_subprocess() -> None:
+    """Patch the functions of the real subprocess module in place.
+
+    subprocess.run() is replaced by a function replaying commands while a
+    pvcr test is active, and globals bound to the original run() are
+    rebound to it in all imported modules. Live executions bypassing pvcr
+    during a pvcr test are counted in SubprocessWrapper.pvcr_bypassed.
+    """
+    patches = [
+        (subprocess, "run", _patched_run),
+        (subprocess.Popen, "_execute_child", _execute_child),
+    ]
+    this_module = sys.modules[__name__]
+    for module in list(sys.modules.values()):
+        if module is subprocess or module is this_module:
+            continue
+
+        for attr, value in list(getattr(module, "__dict__", {}).items()):
+            if value is _orig_run:
+                patches.append((module, attr, _patched_run))
+
+    for obj, attr, patched in patches:
+        _rebound_modules.append((obj, attr, getattr(obj, attr)))
+        setattr(obj, attr, patched)
+
 
 def uninstall_wrapper() -> None:
     sys.modules["subprocess"] = SubprocessWrapper.pvcr_orig_cls
+    os.system = _orig_system
+    os.popen = _orig_popen
 
+    while _rebound_modules:
+        module, attr, value = _rebound_modules.pop()
+        setattr(module, attr, value)
 
-def run(
+
+def _near_misses_hint(recording: Recording) -> str:
+    """Describe the recorded commands closest to an unrecorded one."""
+    near_misses = SubprocessWrapper.pvcr_history.near_misses(recording)
+    if not near_misses:
+        return ""
+
+    lines = []
+    for near_miss in near_misses:
+        line = f"  {near_miss.recording.args} ({near_miss.similarity:.0%} similar)"
+        if near_miss.difference is not None:
+            line += f": {near_miss.difference}"
+        lines.append(line)
+    return "\nClosest recorded commands:\n" + "\n".join(lines)
+
+
+def _pure_key(
     args: list[str] | str,
-    *other_args: Any,
-    stdin: bytes | str | None = None,
-    **other_kwargs: Any,
+    stdin: bytes | str | None,
+    cwd: Any,
+    env: dict[str, str] | None,
+    options: tuple | None,
+) -> tuple | None:
+    """Build the key of the session result of a pure command.
+
+    Args:
+        args: a list of command line arguments, or a shell command string
+        stdin: the data fed to the command
+        cwd: the command working directory
+        env: the command environment
+        options: the options of the caller affecting the result of the
+            command, None if it cannot be reused
+
+    Returns:
+        a hashable key, or None if the command is not declared pure
+    """
+    if not SubprocessWrapper.pvcr_pure_commands or options is None:
+        return None
+
+    if isinstance(args, str | bytes):
+        command_line = os.fsdecode(args)
+    else:
+        command_line = shlex.join(os.fsdecode(arg) for arg in args)
+
+    if not any(p.fullmatch(command_line) for p in SubprocessWrapper.pvcr_pure_commands):
+        return None
+
+    return (
+        command_line,
+        stdin,
+        os.getcwd() if cwd is None else os.fspath(cwd),
+        None if env is None else tuple(sorted(env.items())),
+        options,
+    )
+
+
+def _execute(
+    execute: Callable[[], subprocess.CompletedProcess],
+) -> tuple[
+    subprocess.CompletedProcess | OSError | subprocess.TimeoutExpired,
+    float,
+    ResourceUsage | None,
+]:
+    """Execute a command live and measure the resources it used.
+
+    Args:
+        execute: a function really executing the command
+
+    Returns:
+        the executed process or the recordable exception it raised, its
+        wall-clock duration in microseconds and its resource usage if it
+        could be measured
+    """
+    from .recordings import RECORDED_EXCEPTIONS, ResourceUsage
+
+    _live.executing = True
+    _live.usage = None
+    try:
+        before = time.monotonic()
+        try:
+            ret = execute()
+        except RECORDED_EXCEPTIONS as e:
+            ret = e
+        after = time.monotonic()
+        usage = _live.usage
+    finally:
+        _live.executing = False
+        _live.usage = None
+
+    if usage is not None:
+        usage = ResourceUsage(*usage)
+    return ret, (after - before) * 1000000, usage
+
+
+class _MeasuredPopen(subprocess.Popen):
+    """Popen measuring the resources used by the process, see _execute()."""
+
+    # Resource usage is only available from os.wait4()
+    if _orig_try_wait is not None and hasattr(os, "wait4"):
+        _try_wait = _try_wait
+
+
+def measure_execution(
+    args: list[str | bytes] | str | bytes,
+    input: str | bytes | None = None,
+    timeout: float | None = None,
+    **kwargs: Any,
+) -> tuple[subprocess.CompletedProcess, float, ResourceUsage | None]:
+    """Execute a command live and measure the resources it used.
+
+    The command is executed like subprocess.run() with its outputs captured,
+    whether pvcr is active or not.
+
+    Args:
+        args: a list of command line arguments, or a shell command string
+        input: the data fed to the command
+        timeout: a timeout in seconds
+        **kwargs: other subprocess.Popen() arguments
+
+    Returns:
+        the executed process, its wall-clock duration in microseconds and
+        its resource usage if it could be measured
+
+    Raises:
+        subprocess.TimeoutExpired: if the command timed out
+        OSError: if the command could not be executed
+    """
+
+    def execute() -> subprocess.CompletedProcess:
+        with _MeasuredPopen(
+            args,
+            stdin=None if input is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **kwargs,
+        ) as process:
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                raise
+
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    ret, duration, usage = _execute(execute)
+    if isinstance(ret, BaseException):
+        raise ret
+    return ret, duration, usage
+
+
+def _wait_replayed(duration: float | None, exception: dict[str, Any] | None) -> None:
+    """Wait for the recorded duration of a replayed command.
+
+    Commands which raised an exception are replayed after their duration
+    scaled by SubprocessWrapper.pvcr_exception_delay, instantly by default.
+    """
+    if not SubprocessWrapper.pvcr_do_wait or not duration:
+        return
+
+    if exception is not None:
+        duration *= SubprocessWrapper.pvcr_exception_delay
+    if duration:
+        time.sleep(duration / 1000000)
+
+
+def _raise_recorded(
+    exception: dict[str, Any],
+    args: list[str] | str,
+    stdout: str | bytes | None,
+    stderr: str | bytes | None,
+) -> NoReturn:
+    """Raise the recorded exception of a replayed command."""
+    from .recordings import decode_exception
+
+    logger.debug("Raising recorded %s of command: %s", exception["type"], args)
+    raise decode_exception(exception, args, stdout, stderr)
+
+
+def _program(args: list[str] | str) -> str:
+    """Return the name of the program executed by a command."""
+    if isinstance(args, str | bytes):
+        args = os.fsdecode(args).split(maxsplit=1)[:1]
+    if not args:
+        return ""
+    return os.path.basename(os.fsdecode(args[0]))
+
+
+def _replay_or_execute(
+    args: list[str] | str,
+    stdin: bytes | str | None,
+    cwd: Any,
+    env: dict[str, str] | None,
+    execute: Callable[[], subprocess.CompletedProcess],
+    mode: tuple[bool, str | None, str | None] | None = None,
+    options: tuple | None = None,
 ) -> subprocess.CompletedProcess:
-    recording = SubprocessWrapper.pvcr_history.append(args, stdin)
+    """Replay a command, or execute and record it.
+
+    Args:
+        args: a list of command line arguments, or a shell command string
+        stdin: the data fed to the command
+        cwd: the command working directory
+        env: the command environment
+        execute: a function really executing the command
+        mode: the text mode, encoding and error handler the outputs of a
+            replayed command are converted to, see Recording.outputs(),
+            or None to replay them as recorded
+        options: the options of the caller affecting the result of an
+            executed command, see _pure_key()
+
+    Returns:
+        the recorded or executed process
+    """
+    # Fast path: return a pre-built result from the replay table
+    replay = SubprocessWrapper.pvcr_history.replay(args, stdin, cwd, env)
+    if replay is not None:
+        logger.debug("Replaying recorded command: %s", args)
+        _wait_replayed(replay.duration, replay.exception)
+        if replay.exception is not None:
+            _raise_recorded(
+                replay.exception, args, replay.process.stdout, replay.process.stderr
+            )
+
+        stdout, stderr = replay.process.stdout, replay.process.stderr
+        if mode is not None and replay.recording is not None:
+            stdout, stderr = replay.recording.outputs(*mode)
+
+        # Each replay gets its own process, which the caller may modify
+        return SubprocessWrapper.pvcr_orig_cls.CompletedProcess(
+            replay.process.args, replay.process.returncode, stdout, stderr
+        )
+
+    recording = SubprocessWrapper.pvcr_history.append(args, stdin, cwd, env)
 
     # Return an existing instance if there is a recorded command
     if recording.saved:
         logger.debug("Replaying recorded command: %s", args)
-        if SubprocessWrapper.pvcr_do_wait:
-            time.sleep(recording.duration / 1000000)
+        _wait_replayed(recording.duration, recording.exception)
+        if recording.exception is not None:
+            _raise_recorded(
+                recording.exception, args, recording.stdout, recording.stderr
+            )
+
+        stdout, stderr = recording.stdout, recording.stderr
+        if mode is not None:
+            stdout, stderr = recording.outputs(*mode)
 
         return SubprocessWrapper.pvcr_orig_cls.CompletedProcess(
             recording.args,
             returncode=recording.rc,
-            stdout=recording.stdout,
-            stderr=recording.stderr,
+            stdout=stdout,
+            stderr=stderr,
         )
 
     should_block = (
@@ -49,43 +407,228 @@ def run(
         or SubprocessWrapper.pvcr_history.block_unrecorded
     )
     if should_block:
-        logger.warning("Blocked unrecorded command: %s", args)
-        raise PVCRBlockedRunException(f"Blocked unrecorded command: {args}")
-
-    # Really execute the command and record its result
-    logger.debug("Executing and recording command: %s", args)
-    before = time.time()
-    if "stdout" not in other_kwargs and "stderr" not in other_kwargs:
-        other_kwargs["capture_output"] = True
+        hint = _near_misses_hint(recording)
+        logger.warning("Blocked unrecorded command: %s%s", args, hint)
+        raise PVCRBlockedRunException(f"Blocked unrecorded command: {args}{hint}")
+
+    if SubprocessWrapper.pvcr_history.record_mode == "none":
+        logger.warning(
+            "Executing unrecorded command in 'none' record mode: %s%s",
+            args,
+            _near_misses_hint(recording),
+        )
+
+    # Really execute the command and record its result, pure commands are
+    # executed once per session
+    pure_key = _pure_key(args, stdin, cwd, env, options)
+    pure_result = SubprocessWrapper.pvcr_pure_results.get(pure_key)
+    if pure_result is not None:
+        logger.debug("Recording result of pure command: %s", args)
+        ret, duration, usage = pure_result
+        # Each caller gets its own process, which it may modify
+        ret = SubprocessWrapper.pvcr_orig_cls.CompletedProcess(
+            ret.args, ret.returncode, ret.stdout, ret.stderr
+        )
     else:
-        other_kwargs.setdefault("stdout", SubprocessWrapper.pvcr_orig_cls.PIPE)
-        other_kwargs.setdefault("stderr", SubprocessWrapper.pvcr_orig_cls.PIPE)
-    ret = SubprocessWrapper.pvcr_orig_cls.run(
-        args, *other_args, stdin=stdin, **other_kwargs
-    )
-    after = time.time()
+        logger.debug("Executing and recording command: %s", args)
+        ret, duration, usage = _execute(execute)
+        if pure_key is not None and not isinstance(ret, BaseException):
+            SubprocessWrapper.pvcr_pure_results[pure_key] = (
+                SubprocessWrapper.pvcr_orig_cls.CompletedProcess(
+                    ret.args, ret.returncode, ret.stdout, ret.stderr
+                ),
+                duration,
+                usage,
+            )
+
+        if SubprocessWrapper.pvcr_usage is not None:
+            SubprocessWrapper.pvcr_usage.append((_program(args), duration, usage))
 
-    recording.stdout = ret.stdout
-    recording.stderr = ret.stderr
-    recording.rc = ret.returncode
-    recording.duration = (after - before) * 1000000
+    if isinstance(ret, BaseException):
+        from .recordings import encode_exception
+
+        # Outputs collected before a timeout are recorded with the exception
+        recording.stdout = getattr(ret, "stdout", None)
+        recording.stderr = getattr(ret, "stderr", None)
+        recording.exception = encode_exception(ret)
+    else:
+        recording.stdout = ret.stdout
+        recording.stderr = ret.stderr
+        recording.rc = ret.returncode
+    recording.duration = duration
+    recording.usage = usage
 
     # Save the result to the recordings file
     SubprocessWrapper.pvcr_history.write(recording)
 
+    if isinstance(ret, BaseException):
+        raise ret
     return ret
 
 
+# Output streams of run() whose result can be reused, see _pure_key()
+_REUSABLE_STREAMS = (None, subprocess.PIPE, subprocess.STDOUT, subprocess.DEVNULL)
+
+
+def run(
+    args: list[str] | str,
+    *other_args: Any,
+    stdin: bytes | str | None = None,
+    **other_kwargs: Any,
+) -> subprocess.CompletedProcess:
+    def execute() -> subprocess.CompletedProcess:
+        if "stdout" not in other_kwargs and "stderr" not in other_kwargs:
+            other_kwargs["capture_output"] = True
+        else:
+            other_kwargs.setdefault("stdout", SubprocessWrapper.pvcr_orig_cls.PIPE)
+            other_kwargs.setdefault("stderr", SubprocessWrapper.pvcr_orig_cls.PIPE)
+
+        return _orig_run(args, *other_args, stdin=stdin, **other_kwargs)
+
+    # Replayed outputs are converted to the text mode of the caller
+    encoding = other_kwargs.get("encoding")
+    errors = other_kwargs.get("errors")
+    text = bool(
+        encoding
+        or errors
+        or other_kwargs.get("text")
+        or other_kwargs.get("universal_newlines")
+    )
+
+    # The result of a pure command is reused only by callers getting the
+    # same outputs, and never when they are written to a file
+    options = None
+    streams = (
+        other_kwargs.get("stdout"),
+        other_kwargs.get("stderr"),
+        other_kwargs.get("capture_output"),
+    )
+    if all(stream in _REUSABLE_STREAMS for stream in streams[:2]):
+        options = (text, encoding, errors, *streams, other_kwargs.get("timeout"))
+
+    # Data fed with input= is matched as the command stdin
+    return _replay_or_execute(
+        args,
+        other_kwargs.get("input", stdin),
+        other_kwargs.get("cwd"),
+        other_kwargs.get("env"),
+        execute,
+        (text, encoding, errors),
+        options,
+    )
+
+
+def _wait_status(returncode: int) -> int:
+    """Convert a subprocess return code to an os.wait() exit status."""
+    if returncode < 0:
+        return -returncode
+    return returncode << 8
+
+
+def _write_output(stream: IO[str], data: str | bytes | None) -> None:
+    """Write the output of a command to a standard stream."""
+    if not data:
+        return
+
+    if isinstance(data, bytes):
+        buffer = getattr(stream, "buffer", None)
+        if buffer is None:
+            data = data.decode(errors="replace")
+        else:
+            stream.flush()
+            buffer.write(data)
+            buffer.flush()
+            return
+
+    stream.write(data)
+    stream.flush()
+
+
+def system(command: str) -> int:
+    """Record and replay os.system() calls while a pvcr test is active.
+
+    The command outputs are captured and written to sys.stdout and
+    sys.stderr, instead of being inherited by the command.
+    """
+    if not SubprocessWrapper.pvcr_enabled:
+        return _orig_system(command)
+
+    ret = _replay_or_execute(
+        command,
+        None,
+        None,
+        None,
+        lambda: _orig_run(command, shell=True, capture_output=True),
+        options=("system",),
+    )
+    _write_output(sys.stdout, ret.stdout)
+    _write_output(sys.stderr, ret.stderr)
+    return _wait_status(ret.returncode)
+
+
+class _PopenResult(io.StringIO):
+    """os.popen() stream of a recorded command, see os._wrap_close."""
+
+    def __init__(self, output: str | None, returncode: int) -> None:
+        super().__init__(output or "")
+        self._returncode = returncode
+
+    def close(self) -> int | None:
+        super().close()
+        if self._returncode == 0:
+            return None
+        return _wait_status(self._returncode)
+
+
+def popen(cmd: str, mode: str = "r", buffering: int = -1) -> IO[str]:
+    """Record and replay os.popen() calls while a pvcr test is active.
+
+    Only commands read from are recorded, commands written to are blocked
+    like unrecorded ones or executed.
+    """
+    if not SubprocessWrapper.pvcr_enabled:
+        return _orig_popen(cmd, mode, buffering)
+
+    if mode != "r":
+        should_block = (
+            SubprocessWrapper.pvcr_block_run
+            or SubprocessWrapper.pvcr_history.block_unrecorded
+        )
+        if should_block:
+            logger.warning("Blocked unrecordable command: %s", cmd)
+            raise PVCRBlockedRunException(f"Blocked unrecordable command: {cmd}")
+
+        return _orig_popen(cmd, mode, buffering)
+
+    ret = _replay_or_execute(
+        cmd,
+        None,
+        None,
+        None,
+        lambda: _orig_run(cmd, shell=True, stdout=subprocess.PIPE, text=True),
+        (True, None, None),
+        ("popen",),
+    )
+    return _PopenResult(ret.stdout, ret.returncode)
+
+
 class MetaSubprocessWrapper(type):
     """subprocess class wrapper metaclass."""
 
     pvcr_orig_cls = subprocess
     pvcr_current_request = None
     pvcr_do_wait: bool = True
+    pvcr_exception_delay: float = 0.0
     pvcr_record_mode: str = "none"
     pvcr_block_run: bool = False
     pvcr_history: Recordings
     pvcr_enabled: bool = False
+    pvcr_bypassed: int = 0
+    pvcr_pure_commands: list[re.Pattern[str]] = []
+    pvcr_pure_results: dict[
+        tuple, tuple[subprocess.CompletedProcess, float, ResourceUsage | None]
+    ] = {}
+    pvcr_usage: list[tuple[str, float, ResourceUsage | None]] | None = None
 
     def __getattribute__(cls, item: str) -> Any:
         pvcr_orig_cls = object.__getattribute__(cls, "pvcr_orig_cls")
@@ -1 +1,5 @@
+# pytester restores sys.modules after each in-process run, and the PyYAML C
+# extension cannot be imported twice: import it once before any run.
+import yaml  # noqa: F401
+
 pytest_plugins = ["pytester"]
@@ -0,0 +1,333 @@
+from pytest_pvcr.cli import main
+from pytest_pvcr.recordings import (
+    CassetteBundle,
+    IndexedCassette,
+    JournalCassette,
+    LazyRecording,
+    Recordings,
+    ReplayTable,
+    SqliteDatabase,
+    YamlCassette,
+    open_cassette,
+)
+
+
+def _record(recs: Recordings, args: list[str], stdout: str) -> None:
+    rec = recs.append(args)
+    rec.stdout = stdout
+    rec.rc = 0
+    rec.duration = 100
+    recs.write(rec)
+
+
+class TestOpenCassette:
+    def test_yaml(self, tmp_path):
+        assert isinstance(open_cassette(tmp_path / "test.yaml"), YamlCassette)
+
+    def test_journal(self, tmp_path):
+        assert isinstance(open_cassette(tmp_path / "test.jsonl"), JournalCassette)
+
+    def test_indexed(self, tmp_path):
+        assert isinstance(open_cassette(tmp_path / "test.pvcr"), IndexedCassette)
+
+    def test_default(self, tmp_path):
+        assert isinstance(open_cassette(tmp_path / "test"), YamlCassette)
+
+
+class TestBytesArgs:
+    def _roundtrip(self, cassette):
+        recs = Recordings(cassette, "new")
+        rec = recs.append([b"echo", b"\xff"], stdin=b"in")
+        rec.stdout = b"\xff\n"
+        rec.rc = 0
+        recs.write(rec)
+        rec = recs.append(b"echo \xfe")
+        rec.rc = 0
+        recs.write(rec)
+        return cassette
+
+    def _check(self, cassette):
+        recs = Recordings(cassette, "none")
+        rec = recs.append([b"echo", b"\xff"], stdin=b"in")
+        assert rec.saved is True
+        assert rec.args == [b"echo", b"\xff"]
+        assert rec.stdout == b"\xff\n"
+        assert recs.append(b"echo \xfe").saved is True
+
+    def test_yaml(self, tmp_path):
+        self._check(self._roundtrip(YamlCassette(tmp_path / "test.yaml")))
+
+    def test_journal(self, tmp_path):
+        cassette = self._roundtrip(JournalCassette(tmp_path / "test.jsonl"))
+        cassette.compact()
+        self._check(JournalCassette(tmp_path / "test.jsonl"))
+
+    def test_indexed(self, tmp_path):
+        self._roundtrip(IndexedCassette(tmp_path / "test.pvcr"))
+        self._check(IndexedCassette(tmp_path / "test.pvcr"))
+
+    def test_sqlite(self, tmp_path):
+        database = SqliteDatabase(tmp_path / "recordings.sqlite3")
+        self._roundtrip(database.cassette("test"))
+        self._check(database.cassette("test"))
+
+    def test_bundle(self, tmp_path):
+        bundle = CassetteBundle(tmp_path / "test_module.yaml")
+        self._roundtrip(bundle.cassette("test_a"))
+        bundle.save()
+        self._check(CassetteBundle(tmp_path / "test_module.yaml").cassette("test_a"))
+
+
+class TestJournalCassette:
+    def test_append_only(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        cassette = JournalCassette(path)
+        cassette.write({"args": ["ls"], "rc": 0, "iteration": 1})
+        cassette.write({"args": ["id"], "rc": 0, "iteration": 1})
+        assert len(path.read_text().splitlines()) == 2
+        assert [r["args"] for r in cassette.read()] == [["ls"], ["id"]]
+
+    def test_later_entries_override(self, tmp_path):
+        cassette = JournalCassette(tmp_path / "test.jsonl")
+        cassette.write({"args": ["ls"], "rc": 0, "iteration": 1})
+        cassette.write({"args": ["id"], "rc": 0, "iteration": 1})
+        cassette.write({"args": ["ls"], "rc": 1, "iteration": 1})
+        assert cassette.read() == [
+            {"args": ["ls"], "rc": 1, "iteration": 1},
+            {"args": ["id"], "rc": 0, "iteration": 1},
+        ]
+
+    def test_interrupted_write(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        path.write_text('{"args": ["ls"], "rc": 0, "iteration": 1}\n{"args": ["i')
+        cassette = JournalCassette(path)
+        cassette.write({"args": ["id"], "rc": 0, "iteration": 1})
+        assert [r["args"] for r in cassette.read()] == [["ls"], ["id"]]
+
+    def test_compact(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        cassette = JournalCassette(path)
+        for rc in range(3):
+            cassette.write({"args": ["ls"], "rc": rc, "iteration": 1})
+
+        cassette.compact()
+        assert len(path.read_text().splitlines()) == 1
+        assert cassette.read() == [{"args": ["ls"], "rc": 2, "iteration": 1}]
+
+    def test_recordings(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        recs = Recordings(path, "new")
+        _record(recs, ["echo", "hello"], "hello\n")
+        _record(recs, ["echo", "hello"], "again\n")
+
+        recs = Recordings(path, "all")
+        _record(recs, ["echo", "hello"], "replaced\n")
+        recs.compact()
+
+        recs = Recordings(path, "none")
+        assert recs.append(["echo", "hello"]).stdout == "replaced\n"
+        assert recs.append(["echo", "hello"]).stdout == "again\n"
+        assert len(path.read_text().splitlines()) == 2
+
+    def test_bytes(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        recs = Recordings(path, "new")
+        rec = recs.append(["cat"], stdin=b"\x00\x01")
+        rec.stdout = b"\xff"
+        rec.rc = 0
+        recs.write(rec)
+
+        rec = Recordings(path, "none").append(["cat"], stdin=b"\x00\x01")
+        assert rec.stdout == b"\xff"
+
+
+class TestCassetteBundle:
+    def test_saved_once(self, tmp_path):
+        bundle = CassetteBundle(tmp_path / "test_module.yaml")
+        _record(Recordings(bundle.cassette("test_a"), "new"), ["ls"], "a")
+        _record(Recordings(bundle.cassette("test_b"), "new"), ["id"], "b")
+        assert not bundle.path.exists()
+
+        bundle.save()
+        bundle = CassetteBundle(tmp_path / "test_module.yaml")
+        assert Recordings(bundle.cassette("test_a"), "none").append(["ls"]).saved
+        assert bundle.get("test_b")[0]["stdout"] == "b"
+        assert bundle.get("test_c") is None
+
+    def test_unmodified_not_saved(self, tmp_path):
+        bundle = CassetteBundle(tmp_path / "test_module.yaml")
+        Recordings(bundle.cassette("test_a"), "none").append(["ls"])
+        bundle.save()
+        assert not bundle.path.exists()
+
+    def test_concurrent_save(self, tmp_path):
+        first = CassetteBundle(tmp_path / "test_module.yaml")
+        second = CassetteBundle(tmp_path / "test_module.yaml")
+        _record(Recordings(first.cassette("test_a"), "new"), ["ls"], "a")
+        _record(Recordings(second.cassette("test_b"), "new"), ["id"], "b")
+        first.save()
+        second.save()
+
+        bundle = CassetteBundle(tmp_path / "test_module.yaml")
+        assert bundle.get("test_a") is not None
+        assert bundle.get("test_b") is not None
+
+    def test_migrate(self, tmp_path):
+        legacy = tmp_path / "test_module" / "test_a.yaml"
+        _record(Recordings(legacy, "new"), ["ls"], "a")
+
+        bundle = CassetteBundle(tmp_path / "test_module.yaml")
+        recs = Recordings(bundle.cassette("test_a", legacy), "new")
+        assert recs.append(["ls"]).stdout == "a"
+        _record(recs, ["id"], "b")
+        bundle.save()
+
+        assert not legacy.parent.exists()
+        bundle = CassetteBundle(tmp_path / "test_module.yaml")
+        assert [r["args"] for r in bundle.get("test_a")] == [["ls"], ["id"]]
+
+
+class TestIndexedCassette:
+    def test_recordings(self, tmp_path):
+        path = tmp_path / "test.pvcr"
+        recs = Recordings(path, "new")
+        _record(recs, ["ls"], "a")
+        _record(recs, ["ls"], "b")
+        rec = recs.append(["cat"])
+        rec.stdout = b"\x00\xff"
+        rec.rc = 0
+        recs.write(rec)
+
+        assert path.read_bytes().startswith(IndexedCassette.magic)
+        assert [r["stdout"] for r in open_cassette(path).read()] == [
+            "a",
+            "b",
+            {"__base64__": "AP8="},
+        ]
+
+        recs = Recordings(path, "none")
+        assert recs.append(["ls"]).stdout == "a"
+        assert recs.append(["ls"]).stdout == "b"
+        assert recs.append(["cat"]).stdout == b"\x00\xff"
+
+    def test_lazy_outputs(self, tmp_path, monkeypatch):
+        path = tmp_path / "test.pvcr"
+        recs = Recordings(path, "new")
+        for i in range(10):
+            _record(recs, ["echo", str(i)], str(i))
+
+        reads = []
+        read_payload = IndexedCassette._read_payload
+
+        def _read_payload(self, *args):
+            reads.append(args)
+            return read_payload(self, *args)
+
+        monkeypatch.setattr(IndexedCassette, "_read_payload", _read_payload)
+        recordings = open_cassette(path).read_recordings()
+        assert all(isinstance(r, LazyRecording) for r in recordings)
+        assert [r.args for r in recordings][3] == ["echo", "3"]
+        assert reads == []
+
+        recs = Recordings(path, "none")
+        assert recs.append(["echo", "7"]).stdout == "7"
+        assert len(reads) == 1
+
+        table = ReplayTable.from_file(path)
+        assert len(reads) == 1
+        assert table.get((("echo", "2"), None, 1)).process.stdout == "2"
+        assert len(reads) == 2
+
+    def test_rewrite_after_read(self, tmp_path):
+        path = tmp_path / "test.pvcr"
+        recs = Recordings(path, "new")
+        _record(recs, ["ls"], "a")
+
+        cassette = open_cassette(path)
+        (recording,) = cassette.read_recordings()
+        cassette.rewrite([{"args": ["id"], "stdout": "longer output", "rc": 0}])
+        assert recording.stdout == "a"
+
+    def test_write_keeps_payloads(self, tmp_path):
+        path = tmp_path / "test.pvcr"
+        _record(Recordings(path, "new"), ["ls"], "a")
+
+        (recording,) = open_cassette(path).read_recordings()
+        recs = Recordings(path, "all")
+        _record(recs, ["ls"], "b")
+        _record(recs, ["id"], "c")
+        assert recording._load is not None
+        assert recording.stdout == "a"
+
+        cassette = open_cassette(path)
+        assert [r["stdout"] for r in cassette.read()] == ["b", "c"]
+        size = path.stat().st_size
+        cassette.compact()
+        assert path.stat().st_size < size
+        assert [r["stdout"] for r in cassette.read()] == ["b", "c"]
+
+
+class TestSqliteCassette:
+    def test_recordings(self, tmp_path):
+        database = SqliteDatabase(tmp_path / "recordings.sqlite3")
+        cassette = database.cassette("tests/recordings/test_module/test_a")
+        assert not cassette.exists()
+        assert database.connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+        recs = Recordings(cassette, "new")
+        _record(recs, ["echo", "hello"], "hello\n")
+        _record(recs, ["echo", "hello"], "again\n")
+        rec = recs.append(["cat"])
+        rec.stdout = b"\x00\xff"
+        rec.rc = 0
+        recs.write(rec)
+        assert cassette.exists()
+
+        # Outputs are stored as is, without base64
+        rows = database.connection.execute("SELECT stdout FROM recordings")
+        assert [stdout for (stdout,) in rows] == ["hello\n", "again\n", b"\x00\xff"]
+        assert cassette.read()[2]["stdout"] == {"__base64__": "AP8="}
+
+        recs = Recordings(database.cassette(cassette.name), "all")
+        _record(recs, ["echo", "hello"], "replaced\n")
+
+        recs = Recordings(database.cassette(cassette.name), "none")
+        assert recs.append(["echo", "hello"]).stdout == "replaced\n"
+        assert recs.append(["echo", "hello"]).stdout == "again\n"
+        assert recs.append(["cat"]).stdout == b"\x00\xff"
+        assert [r["stdout"] for r in cassette.read()][:2] == ["replaced\n", "again\n"]
+
+    def test_cassettes_are_isolated(self, tmp_path):
+        database = SqliteDatabase(tmp_path / "recordings.sqlite3")
+        database.cassette("a").write({"args": ["ls"], "rc": 0, "iteration": 1})
+        database.cassette("b").write({"args": ["ls"], "rc": 1, "iteration": 1})
+        database.cassette("a").clear()
+
+        assert database.names() == ["b"]
+        assert database.cassette("b").read() == [
+            {"args": ["ls"], "rc": 1, "iteration": 1}
+        ]
+
+    def test_write_replaces_command(self, tmp_path):
+        cassette = SqliteDatabase(tmp_path / "recordings.sqlite3").cassette("a")
+        cassette.write({"args": ["ls"], "rc": 0, "iteration": 1})
+        cassette.write({"args": ["id"], "rc": 0, "iteration": 1})
+        cassette.write({"args": ["ls"], "rc": 2, "iteration": 1})
+        assert cassette.read() == [
+            {"args": ["ls"], "rc": 2, "iteration": 1},
+            {"args": ["id"], "rc": 0, "iteration": 1},
+        ]
+
+    def test_import_export(self, tmp_path):
+        path = tmp_path / "tests" / "recordings" / "test_module" / "test_a.yaml"
+        recs = Recordings(path, "new")
+        _record(recs, ["echo", "hello"], "hello\n")
+
+        database = tmp_path / "recordings.sqlite3"
+        assert main(["sqlite-import", str(database), str(tmp_path / "tests")]) == 0
+
+        exported = tmp_path / "exported"
+        assert main(["sqlite-export", str(database), "-d", str(exported)]) == 0
+
+        copy = exported / "tests" / "recordings" / "test_module" / "test_a.yaml"
+        assert open_cassette(copy).read() == open_cassette(path).read()
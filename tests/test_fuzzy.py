@@ -1,6 +1,11 @@
+import shlex
 from pathlib import Path
 
-from pytest_pvcr.recordings import FUZZY_PLACEHOLDER, Recordings
+from pytest_pvcr.recordings import (
+    FUZZY_PLACEHOLDER,
+    FUZZY_PLACEHOLDER_BYTES,
+    Recordings,
+)
 
 
 def _make_recordings(fuzzy_matchers: list[str]) -> Recordings:
@@ -50,3 +55,57 @@ class TestFuzzyCompiler:
         result = recs._fuzzy_compiler(["cat", "/tmp/test/file.txt"])
         assert FUZZY_PLACEHOLDER in result[1]
         assert "file.txt" in result[1]
+
+    def test_bytes_kept_as_bytes(self):
+        recs = _make_recordings([])
+        assert recs._fuzzy_compiler([b"ls", "/tmp"]) == [b"ls", "/tmp"]
+
+    def test_bytes_replacement(self):
+        recs = _make_recordings(["--dry-run"])
+        result = recs._fuzzy_compiler([b"kubectl", b"--dry-run"])
+        assert result == [b"kubectl", FUZZY_PLACEHOLDER_BYTES]
+
+    def test_bytes_group_matching(self):
+        recs = _make_recordings([r"^.+\/(kubeconfig)$"])
+        result = recs._fuzzy_compiler([b"/home/user/kubeconfig"])
+        assert result == [FUZZY_PLACEHOLDER_BYTES + b"kubeconfig"]
+
+    def test_str_only_matcher(self):
+        recs = _make_recordings([r"\N{BULLET}"])
+        assert recs._fuzzy_compiler([b"a", "\u2022"]) == [b"a", FUZZY_PLACEHOLDER]
+
+    def test_path(self):
+        recs = _make_recordings([])
+        assert recs._fuzzy_compiler([Path("/tmp")]) == ["/tmp"]
+
+
+class TestFuzzyCommand:
+    def test_shell_string_kept(self):
+        recs = _make_recordings(["--dry-run"])
+        assert recs._fuzzy_command("kubectl apply") == "kubectl apply"
+
+    def test_shell_string_tokens(self):
+        recs = _make_recordings([r"^.+\/(kubeconfig)$"])
+        result = recs._fuzzy_command("kubectl --kubeconfig /home/user/kubeconfig get")
+        assert result == f"kubectl --kubeconfig {FUZZY_PLACEHOLDER}kubeconfig get"
+
+    def test_shell_string_syntax_kept(self):
+        recs = _make_recordings([r"/home/\w+"])
+        result = recs._fuzzy_command('ls /home/bob | grep "a b" && echo $HOME')
+        assert result == f'ls {FUZZY_PLACEHOLDER} | grep "a b" && echo $HOME'
+
+    def test_shell_string_quoted_word(self):
+        recs = _make_recordings([r"/home/\w+"])
+        result = recs._fuzzy_command("cat '/home/bob' \"/home/al\"/x")
+        assert result == shlex.join(
+            ["cat", FUZZY_PLACEHOLDER, f"{FUZZY_PLACEHOLDER}/x"]
+        )
+
+    def test_shell_string_unbalanced_quotes(self):
+        recs = _make_recordings(["--dry-run"])
+        result = recs._fuzzy_command("echo 'oops --dry-run")
+        assert result == f"echo 'oops {FUZZY_PLACEHOLDER}"
+
+    def test_list(self):
+        recs = _make_recordings(["--dry-run"])
+        assert recs._fuzzy_command(["ls", "--dry-run"]) == ["ls", FUZZY_PLACEHOLDER]
@@ -0,0 +1,146 @@
+import hashlib
+
+import pytest
+
+from pytest_pvcr.recordings import (
+    MatchStrategy,
+    Recording,
+    Recordings,
+    ReplayTable,
+    StdinDigest,
+    open_cassette,
+)
+
+
+def _make_recordings(tmp_path, fields, mode="new", **kwargs) -> Recordings:
+    return Recordings(
+        tmp_path / "test.yaml",
+        record_mode=mode,
+        match_strategy=MatchStrategy(fields),
+        **kwargs,
+    )
+
+
+def _record(recs: Recordings, args: list[str], stdout: str, **kwargs) -> None:
+    rec = recs.append(args, **kwargs)
+    rec.stdout = stdout
+    rec.rc = 0
+    rec.duration = 100
+    recs.write(rec)
+
+
+class TestMatchStrategy:
+    def test_presets(self):
+        assert MatchStrategy().fields == ("args", "stdin", "iteration")
+        assert MatchStrategy("ignore_iteration").fields == ("args", "stdin")
+        assert MatchStrategy("ignore_stdin").fields == ("args", "iteration")
+
+    def test_unknown_preset(self):
+        with pytest.raises(ValueError):
+            MatchStrategy("nonexistent")
+
+    def test_unknown_field(self):
+        with pytest.raises(ValueError):
+            MatchStrategy(["args", "nonexistent"])
+
+    def test_args_subset(self):
+        rec = Recording(["kubectl", "get", "pods", "-n", "default"])
+        assert MatchStrategy(["args[0:3]"]).key(rec) == (("kubectl", "get", "pods"),)
+        assert MatchStrategy(["args[1]"]).key(rec) == (("get",),)
+        assert MatchStrategy(["args[-1]"]).key(rec) == (("default",),)
+
+    def test_args_subset_shell_string(self):
+        rec = Recording("kubectl get 'my pod'")
+        assert MatchStrategy(["args[1:]"]).key(rec) == (("get", "my pod"),)
+
+    def test_env(self):
+        rec = Recording(["ls"], env={"HOME": "/root"})
+        assert MatchStrategy(["args", "env:HOME"]).key(rec) == (("ls",), "/root")
+
+    def test_without_iteration(self):
+        assert MatchStrategy().without_iteration() == MatchStrategy("ignore_iteration")
+
+
+class TestStrategies:
+    def test_ignore_iteration(self, tmp_path):
+        _record(_make_recordings(tmp_path, "default"), ["date"], "monday\n")
+
+        recs = _make_recordings(tmp_path, "ignore_iteration")
+        assert recs.append(["date"]).stdout == "monday\n"
+        assert recs.append(["date"]).stdout == "monday\n"
+
+    def test_ignore_stdin(self, tmp_path):
+        _record(_make_recordings(tmp_path, "default"), ["cat"], "out", stdin="a")
+
+        recs = _make_recordings(tmp_path, "ignore_stdin")
+        rec = recs.append(["cat"], stdin="b")
+        assert rec.saved is True
+        assert rec.stdout == "out"
+
+    def test_args_subset(self, tmp_path):
+        _record(_make_recordings(tmp_path, "default"), ["git", "log", "-1"], "log")
+
+        recs = _make_recordings(tmp_path, ["args[0:2]", "iteration"])
+        assert recs.append(["git", "log", "-5"]).saved is True
+        assert recs.append(["git", "status"]).saved is False
+
+    def test_cwd(self, tmp_path):
+        fields = ["args", "iteration", "cwd"]
+        recs = _make_recordings(tmp_path, fields)
+        _record(recs, ["ls"], "a", cwd="/a")
+        _record(recs, ["ls"], "b", cwd="/b")
+
+        recs = _make_recordings(tmp_path, fields, mode="none")
+        assert recs.append(["ls"], cwd="/b").stdout == "b"
+        assert recs.append(["ls"], cwd="/a").stdout == "a"
+        assert recs.append(["ls"], cwd="/c").saved is False
+
+    def test_env(self, tmp_path):
+        fields = ["args", "iteration", "env:TARGET"]
+        recs = _make_recordings(tmp_path, fields)
+        _record(recs, ["deploy"], "prod", env={"TARGET": "prod"})
+        _record(recs, ["deploy"], "dev", env={"TARGET": "dev", "OTHER": "x"})
+
+        recs = _make_recordings(tmp_path, fields, mode="none")
+        assert recs.append(["deploy"], env={"TARGET": "dev"}).stdout == "dev"
+        assert recs.append(["deploy"], env={}).saved is False
+
+
+class TestStdinDigest:
+    def test_of(self):
+        digest = StdinDigest.of("hello")
+        assert digest.sha256 == hashlib.sha256(b"hello").hexdigest()
+        assert digest.raw is None
+        assert digest == StdinDigest.of(b"hello")
+        assert StdinDigest.of(b"hello", keep=True).raw == b"hello"
+
+    def test_stored_as_digest(self, tmp_path):
+        recs = _make_recordings(tmp_path, "stdin_digest")
+        _record(recs, ["kubectl", "apply", "-f", "-"], "ok", stdin="x" * 100000)
+        assert next(iter(recs._history))[1] == StdinDigest.of("x" * 100000).sha256
+
+        (entry,) = open_cassette(tmp_path / "test.yaml").read()
+        assert entry["stdin"] == {"__sha256__": StdinDigest.of("x" * 100000).sha256}
+
+        recs = _make_recordings(tmp_path, "stdin_digest", mode="none")
+        assert recs.append(["kubectl", "apply", "-f", "-"], "x" * 100000).saved
+        assert not recs.append(["kubectl", "apply", "-f", "-"], "y").saved
+
+    def test_keep_stdin(self, tmp_path):
+        recs = _make_recordings(tmp_path, "stdin_digest", keep_stdin=True)
+        _record(recs, ["psql"], "ok", stdin=b"SELECT 1;")
+
+        (entry,) = open_cassette(tmp_path / "test.yaml").read()
+        assert Recording.from_encoded_dict(entry).stdin.raw == b"SELECT 1;"
+
+    def test_raw_recordings(self, tmp_path):
+        _record(_make_recordings(tmp_path, "default"), ["cat"], "out", stdin="a")
+
+        recs = _make_recordings(tmp_path, "stdin_digest", mode="none")
+        assert recs.append(["cat"], stdin="a").stdout == "out"
+
+        table = ReplayTable.from_file(
+            tmp_path / "test.yaml", MatchStrategy("stdin_digest")
+        )
+        recs = _make_recordings(tmp_path, "stdin_digest", "none", replay_table=table)
+        assert recs.replay(["cat"], stdin="a").process.stdout == "out"
@@ -1,5 +1,10 @@
+import json
 import textwrap
 
+import pytest
+
+from pytest_pvcr.recordings import SqliteDatabase
+
 
 def test_pvcr_records_and_replays(pytester):
     pytester.makepyfile(
@@ -140,3 +145,755 @@ def test_pvcr_record_mode_once_blocks_new(pytester):
     # Second run with new command should fail
     result = pytester.runpytest("test_second.py", "--pvcr-record-mode=once", "-v")
     result.assert_outcomes(failed=1)
+
+
+def test_pvcr_match_on(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import pytest
+
+        @pytest.mark.pvcr(match_on="ignore_iteration")
+        def test_echo():
+            for _ in range(3):
+                ret = subprocess.run(["echo", "hello"])
+                assert b"hello" in ret.stdout
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new", "-v")
+    result.assert_outcomes(passed=1)
+
+    # Only the first occurence was executed and recorded
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run", "-v")
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_match_on_invalid(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import pytest
+
+        @pytest.mark.pvcr(match_on="nonexistent")
+        def test_echo():
+            pass
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=none")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+def test_pvcr_cache(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_echo():
+            ret = subprocess.run(["echo", "hello"])
+            assert b"hello" in ret.stdout
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new", "--pvcr-cache")
+    result.assert_outcomes(passed=1)
+    assert list(pytester.path.glob(".pytest_cache/d/pvcr/*.pickle"))
+
+    result = pytester.runpytest(
+        "--pvcr-record-mode=none", "--pvcr-block-run", "--pvcr-cache"
+    )
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_durations(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_wait():
+            subprocess.run(["echo", "hello"])
+
+        @pytest.mark.pvcr(wait=False)
+        def test_no_wait():
+            subprocess.run(["echo", "hello"])
+
+        @pytest.mark.pvcr()
+        def test_not_recorded():
+            pass
+
+        def test_unmarked():
+            pass
+        """)
+    )
+    pytester.runpytest("--pvcr-record-mode=new")
+    durations_file = pytester.path / "durations.json"
+    durations_file.write_text('{"other::test": 1.5}')
+
+    result = pytester.runpytest(f"--pvcr-durations={durations_file}", "--co")
+    assert result.ret == 0
+    durations = json.loads(durations_file.read_text())
+    assert durations["other::test"] == 1.5
+    assert durations["test_pvcr_durations.py::test_wait"] > 0
+    assert durations["test_pvcr_durations.py::test_no_wait"] == 0
+    assert "test_pvcr_durations.py::test_not_recorded" not in durations
+    assert "test_pvcr_durations.py::test_unmarked" not in durations
+
+
+def test_pvcr_storage_journal(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_echo():
+            ret = subprocess.run(["echo", "hello"])
+            assert b"hello" in ret.stdout
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=all", "--pvcr-storage=journal")
+    result.assert_outcomes(passed=1)
+    result = pytester.runpytest("--pvcr-record-mode=all", "--pvcr-storage=journal")
+    result.assert_outcomes(passed=1)
+
+    # Compacted at the end of the session
+    journals = list(pytester.path.glob("recordings/**/*.jsonl"))
+    assert len(journals) == 1
+    assert len(journals[0].read_text().splitlines()) == 1
+
+    result = pytester.runpytest(
+        "--pvcr-record-mode=none", "--pvcr-block-run", "--pvcr-storage=journal"
+    )
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_storage_sqlite(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_echo():
+            ret = subprocess.run(["echo", "hello"])
+            assert b"hello" in ret.stdout
+
+        @pytest.mark.pvcr()
+        def test_cat():
+            ret = subprocess.run(["cat"], input=b"\\xff")
+            assert ret.stdout == b"\\xff"
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new", "--pvcr-storage=sqlite")
+    result.assert_outcomes(passed=2)
+
+    # One database for all the tests, and no recordings files
+    assert not (pytester.path / "recordings").exists()
+    database = SqliteDatabase(pytester.path / "recordings.sqlite3")
+    assert database.names() == [
+        "recordings/test_pvcr_storage_sqlite/test_cat",
+        "recordings/test_pvcr_storage_sqlite/test_echo",
+    ]
+    database.close()
+
+    result = pytester.runpytest(
+        "--pvcr-record-mode=none", "--pvcr-block-run", "--pvcr-storage=sqlite"
+    )
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_replayed_process_not_shared(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        from pytest_pvcr.plugin import replay_tables_key
+
+        @pytest.mark.pvcr(match_on="ignore_iteration")
+        @pytest.mark.parametrize("i", [1, 2])
+        def test_param(i):
+            for _ in range(2):
+                ret = subprocess.run(["echo", "ok"], capture_output=True)
+                assert ret.returncode == 0
+                assert ret.stdout == b"ok\\n"
+                ret.returncode = 7
+                ret.stdout = b"modified"
+
+        @pytest.mark.pvcr()
+        def test_other(request):
+            subprocess.run(["echo", "other"], capture_output=True)
+            # Only the replay table of the running test is kept
+            tables = request.config.stash.get(replay_tables_key, {})
+            assert len(tables) <= 1
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=3)
+
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=3)
+
+
+def test_pvcr_stdin_devnull(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_devnull():
+            for _ in range(2):
+                ret = subprocess.run(
+                    ["echo", "ok"], stdin=subprocess.DEVNULL, capture_output=True
+                )
+                assert ret.stdout == b"ok\\n"
+
+        @pytest.mark.pvcr(match_on="stdin_digest")
+        def test_devnull_digest():
+            ret = subprocess.run(
+                ["echo", "ok"], stdin=subprocess.DEVNULL, capture_output=True
+            )
+            assert ret.stdout == b"ok\\n"
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=2)
+
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_replay_text_mode(pytester):
+    test_file = textwrap.dedent(r"""
+        import subprocess
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_mode():
+            ret = subprocess.run(["printf", r"caf\303\251\r\n"], {kwargs})
+            assert ret.stdout == {stdout}
+        """)
+    pytester.makepyfile(test_file.format(kwargs="", stdout=r'b"caf\xc3\xa9\r\n"'))
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=1)
+
+    # Outputs recorded as bytes are decoded for text mode callers
+    pytester.makepyfile(test_file.format(kwargs='encoding="utf-8"', stdout='"café\\n"'))
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_shell_string(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_echo():
+            ret = subprocess.run("echo hello | tr a-z A-Z", shell=True)
+            assert ret.stdout == b"HELLO\\n"
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=1)
+    recordings = next(pytester.path.glob("recordings/**/*.yaml")).read_text()
+    assert "args: echo hello | tr a-z A-Z" in recordings
+
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_not_installed_without_marker(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import sys
+        import types
+
+        def test_real_subprocess():
+            assert isinstance(sys.modules["subprocess"], types.ModuleType)
+            assert isinstance(subprocess, types.ModuleType)
+        """)
+    )
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_installed_in_collected_modules(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import sys
+        import types
+
+        import pytest
+
+        def test_unmarked():
+            assert not isinstance(sys.modules["subprocess"], types.ModuleType)
+            assert not isinstance(subprocess, types.ModuleType)
+
+        @pytest.mark.pvcr()
+        def test_marked():
+            subprocess.run(["echo", "hello"])
+        """)
+    )
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_fixture_only_for_marked_tests(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import pytest
+
+        def test_unmarked(request):
+            assert "pvcr" not in request.fixturenames
+
+        @pytest.mark.pvcr()
+        def test_marked(request, pvcr):
+            assert "pvcr" in request.fixturenames
+            assert pvcr is not None
+
+        @pytest.mark.pvcr()
+        class TestMarked:
+            def test_method(self, request):
+                assert "pvcr" in request.fixturenames
+        """)
+    )
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=3)
+
+
+def test_pvcr_fixture_commands_recorded(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.fixture
+        def repo():
+            return subprocess.run(["echo", "initialized"]).stdout
+
+        @pytest.mark.pvcr()
+        def test_a(repo):
+            assert repo == b"initialized\\n"
+
+        @pytest.mark.pvcr()
+        def test_b(repo, pvcr):
+            assert repo == b"initialized\\n"
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=2)
+
+    recordings = pytester.path / "recordings" / "test_pvcr_fixture_commands_recorded"
+    assert "initialized" in (recordings / "test_a.yaml").read_text()
+    assert "initialized" in (recordings / "test_b.yaml").read_text()
+
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_stdin_digest(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.mark.pvcr(match_on="stdin_digest")
+        def test_cat():
+            ret = subprocess.run(["cat"], input=b"x" * 100000)
+            assert ret.stdout == b"x" * 100000
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=1)
+
+    recordings = (pytester.path / "recordings").rglob("*.yaml")
+    content = next(recordings).read_text()
+    assert "__sha256__" in content
+    assert "raw" not in content
+
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_module_layout(pytester):
+    pytester.makepyfile(
+        test_module=textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.mark.pvcr()
+        @pytest.mark.parametrize("word", ["hello", "world"])
+        def test_echo(word):
+            ret = subprocess.run(["echo", word])
+            assert ret.stdout == f"{word}\\n".encode()
+        """)
+    )
+    # Per-test recordings are migrated to the module bundle
+    result = pytester.runpytest("--pvcr-record-mode=new", "-k", "hello")
+    result.assert_outcomes(passed=1)
+    legacy = pytester.path / "recordings" / "test_module" / "test_echo.yaml"
+    assert legacy.exists()
+
+    result = pytester.runpytest("--pvcr-record-mode=new", "--pvcr-layout=module")
+    result.assert_outcomes(passed=2)
+    assert not legacy.exists()
+    bundle = (pytester.path / "recordings" / "test_module.yaml").read_text()
+    assert "test_echo[hello]" in bundle
+    assert "test_echo[world]" in bundle
+
+    result = pytester.runpytest(
+        "--pvcr-record-mode=none", "--pvcr-block-run", "--pvcr-layout=module"
+    )
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_module_layout_journal(pytester):
+    pytester.makepyfile("def test_nothing(): pass")
+    result = pytester.runpytest("--pvcr-layout=module", "--pvcr-storage=journal")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+def test_pvcr_block_run_near_misses(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_echo():
+            subprocess.run(["echo", "hello", "world"])
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=1)
+
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_echo():
+            subprocess.run(["echo", "hello", "there"])
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(failed=1)
+    result.stdout.re_match_lines(
+        [
+            r".*Closest recorded commands:",
+            r".*\['echo', 'hello', 'world'\] \(50% similar\)",
+        ]
+    )
+
+
+def test_pvcr_os_system_and_popen(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import os
+        from os import system
+
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_os(capfd):
+            assert system("echo hello; exit 3") == 3 << 8
+            assert capfd.readouterr().out == "hello\\n"
+
+            stream = os.popen("echo world")
+            assert stream.read() == "world\\n"
+            assert stream.close() is None
+
+            with os.popen("exit 2") as stream:
+                assert stream.read() == ""
+            assert stream.close() == 2 << 8
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=1)
+
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_os_popen_write_blocked(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import os
+
+        import pytest
+
+        from pytest_pvcr.wrapper import PVCRBlockedRunException
+
+        @pytest.mark.pvcr()
+        def test_os():
+            with pytest.raises(PVCRBlockedRunException):
+                os.popen("cat", "w")
+
+        def test_unmarked():
+            assert os.system("true") == 0
+        """)
+    )
+    result = pytester.runpytest("--pvcr-block-run")
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_patch_subprocess(pytester):
+    pytester.makepyfile(
+        helper=textwrap.dedent("""\
+        from subprocess import run
+
+        def echo():
+            return run(["echo", "hello"], capture_output=True)
+        """)
+    )
+    pytester.makeconftest("import helper")
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        import helper
+
+        @pytest.mark.pvcr()
+        def test_echo():
+            assert helper.echo().stdout == b"hello\\n"
+            subprocess.Popen(["true"]).wait()
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new", "--pvcr-patch-subprocess")
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(
+        ["*pvcr live executions bypassing pvcr*", "*test_echo: 1"]
+    )
+
+    # The command run from the module imported by conftest is recorded
+    recordings = next((pytester.path / "recordings").rglob("*.yaml")).read_text()
+    assert "echo" in recordings
+
+    result = pytester.runpytest(
+        "--pvcr-record-mode=none", "--pvcr-block-run", "--pvcr-patch-subprocess"
+    )
+    result.assert_outcomes(passed=1)
+
+
+def test_pvcr_pure_commands(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        COMMAND = ["sh", "-c", "echo x >> counter; wc -l < counter"]
+
+        @pytest.mark.pvcr(pure=[r"sh -c .*"])
+        def test_first():
+            assert subprocess.run(COMMAND, capture_output=True).stdout == b"1\\n"
+
+        @pytest.mark.pvcr(pure=[r"sh -c .*"])
+        def test_second():
+            assert subprocess.run(COMMAND, capture_output=True).stdout == b"1\\n"
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=2)
+    assert (pytester.path / "counter").read_text() == "x\n"
+
+    # Each test still records the command in its own cassette
+    recordings = pytester.path / "recordings" / "test_pvcr_pure_commands"
+    assert "counter" in (recordings / "test_first.yaml").read_text()
+    assert "counter" in (recordings / "test_second.yaml").read_text()
+
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_pure_commands_caller_options(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        COMMAND = ["sh", "-c", "echo x >> counter; wc -l < counter"]
+
+        @pytest.mark.pvcr(pure=[r"sh -c .*"])
+        def test_binary():
+            ret = subprocess.run(COMMAND, capture_output=True)
+            assert ret.stdout == b"1\\n"
+            ret.stdout = b"modified"
+
+        @pytest.mark.pvcr(pure=[r"sh -c .*"])
+        def test_binary_again():
+            assert subprocess.run(COMMAND, capture_output=True).stdout == b"1\\n"
+
+        @pytest.mark.pvcr(pure=[r"sh -c .*"])
+        def test_text():
+            ret = subprocess.run(COMMAND, capture_output=True, text=True)
+            assert ret.stdout == "2\\n"
+
+        @pytest.mark.pvcr(pure=[r"sh -c .*"])
+        def test_devnull():
+            ret = subprocess.run(COMMAND, stdout=subprocess.DEVNULL)
+            assert ret.stdout is None
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=4)
+    assert (pytester.path / "counter").read_text() == "x\n" * 3
+
+
+def test_pvcr_pure_commands_option(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_first():
+            subprocess.run("echo x >> counter", shell=True)
+
+        @pytest.mark.pvcr()
+        def test_second():
+            subprocess.run("echo x >> counter", shell=True)
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new", "--pvcr-pure-command=echo .*")
+    result.assert_outcomes(passed=2)
+    assert (pytester.path / "counter").read_text() == "x\n"
+
+
+def test_pvcr_pure_commands_invalid(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import pytest
+
+        @pytest.mark.pvcr(pure=["("])
+        def test_invalid():
+            pass
+        """)
+    )
+    result = pytester.runpytest()
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+def test_pvcr_usage_report(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import sys
+
+        import pytest
+
+        @pytest.mark.pvcr()
+        def test_usage():
+            subprocess.run([sys.executable, "-c", "sum(range(100000))"])
+            subprocess.run("true", shell=True)
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new", "--pvcr-usage-report")
+    result.assert_outcomes(passed=1)
+    result.stdout.re_match_lines(
+        [
+            r".*pvcr resource usage of executed commands.*",
+            r"program +runs +wall \(s\) +user \(s\) +sys \(s\) +max RSS \(MiB\)",
+            r"python\S* +1 +[\d.]+ +[\d.]+ +[\d.]+ +[\d.]+",
+            r"true +1 .*",
+        ]
+    )
+
+    recordings = next((pytester.path / "recordings").rglob("*.yaml")).read_text()
+    assert "maxrss:" in recordings
+
+    # Replayed commands are not reported
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-usage-report")
+    result.assert_outcomes(passed=1)
+    assert "pvcr resource usage" not in result.stdout.str()
+
+
+def test_pvcr_recorded_exceptions(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+        import time
+
+        import pytest
+
+        def timeout():
+            before = time.monotonic()
+            with pytest.raises(subprocess.TimeoutExpired) as excinfo:
+                subprocess.run(
+                    "echo started; sleep 5",
+                    shell=True,
+                    capture_output=True,
+                    timeout=0.3,
+                )
+            assert excinfo.value.stdout == b"started\\n"
+            assert excinfo.value.timeout == 0.3
+            return time.monotonic() - before
+
+        @pytest.mark.pvcr()
+        def test_exceptions(request):
+            elapsed = timeout()
+            if request.config.getoption("--pvcr-record-mode") == "none":
+                assert elapsed < 0.2
+
+            with pytest.raises(FileNotFoundError) as excinfo:
+                subprocess.run(["pvcr-missing-command"])
+            assert excinfo.value.filename == "pvcr-missing-command"
+
+            with pytest.raises(PermissionError):
+                subprocess.run(["/"])
+
+        @pytest.mark.pvcr(exception_delay=1.0)
+        def test_exception_delay():
+            elapsed = timeout()
+            assert elapsed >= 0.25
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new")
+    result.assert_outcomes(passed=2)
+
+    recordings = pytester.path / "recordings" / "test_pvcr_recorded_exceptions"
+    recorded = (recordings / "test_exceptions.yaml").read_text()
+    assert "type: TimeoutExpired" in recorded
+    assert "type: FileNotFoundError" in recorded
+    assert "type: PermissionError" in recorded
+
+    # Exceptions are raised again without executing the commands
+    result = pytester.runpytest("--pvcr-record-mode=none", "--pvcr-block-run")
+    result.assert_outcomes(passed=2)
+
+
+def test_pvcr_synthesize(pytester):
+    pytester.makepyfile(
+        textwrap.dedent("""\
+        import subprocess
+
+        import pytest
+
+        @pytest.mark.pvcr(wait=False)
+        def test_load(pvcr):
+            pvcr.synthesize(["deploy", "{i}"], 500, rc=[0, 0, 1], size=64, seed=0)
+            rcs = [subprocess.run(["deploy", str(i)]).returncode for i in range(500)]
+            assert set(rcs) == {0, 1}
+        """)
+    )
+    result = pytester.runpytest("--pvcr-record-mode=new", "--pvcr-block-run")
+    result.assert_outcomes(passed=1)
+    assert not (pytester.path / "recordings").exists()
@@ -1,4 +1,11 @@
-from pytest_pvcr.recordings import Recording
+from subprocess import TimeoutExpired
+
+from pytest_pvcr.recordings import (
+    Recording,
+    ResourceUsage,
+    decode_exception,
+    encode_exception,
+)
 
 
 class TestRecordingInit:
@@ -40,6 +47,7 @@ class TestToEncodedDict:
         assert "stdin" not in d
         assert "stdout" not in d
         assert "stderr" not in d
+        assert "usage" not in d
 
     def test_full(self):
         rec = Recording(
@@ -86,6 +94,13 @@ class TestFromEncodedDict:
         assert rec.stdout is None
         assert rec.stderr is None
         assert rec.duration is None
+        assert rec.usage is None
+
+    def test_usage_roundtrip(self):
+        original = Recording(["ls"], rc=0, usage=ResourceUsage(0.25, 0.5, 2048))
+        d = original.to_encoded_dict()
+        assert d["usage"] == {"utime": 0.25, "stime": 0.5, "maxrss": 2048}
+        assert Recording.from_encoded_dict(d).usage == original.usage
 
 
 class TestCopy:
@@ -146,3 +161,83 @@ class TestEq:
     def test_non_recording(self):
         rec = Recording(["ls"])
         assert rec.__eq__("not a recording") is NotImplemented
+
+
+class TestKey:
+    def test_key(self):
+        rec = Recording(["ls"], stdin="in", iteration=2)
+        assert rec.key == (("ls",), "in", 2)
+
+    def test_key_follows_changes(self):
+        rec = Recording(["ls"])
+        rec.iteration = 3
+        assert rec.match(["ls"], iteration=3) is True
+        assert rec.key == (("ls",), None, 3)
+
+    def test_hash(self):
+        a = Recording(["ls"], stdout="a")
+        b = Recording(["ls"], stdout="b")
+        assert hash(a) == hash(b)
+        assert len({a, b}) == 1
+
+    def test_slots(self):
+        rec = Recording(["ls"])
+        assert not hasattr(rec, "__dict__")
+
+
+class TestExceptions:
+    def test_timeout(self):
+        exception = TimeoutExpired(["sleep", "5"], 0.5)
+        data = encode_exception(exception)
+        assert data == {"type": "TimeoutExpired", "timeout": 0.5}
+
+        decoded = decode_exception(data, ["sleep", "5"], b"out", b"err")
+        assert isinstance(decoded, TimeoutExpired)
+        assert decoded.cmd == ["sleep", "5"]
+        assert decoded.stdout == b"out"
+        assert decoded.stderr == b"err"
+
+    def test_os_error(self):
+        exception = FileNotFoundError(2, "No such file or directory", b"missing")
+        data = encode_exception(exception)
+        assert data["filename"] == "missing"
+
+        decoded = decode_exception(data, ["missing"])
+        assert type(decoded) is FileNotFoundError
+        assert decoded.errno == 2
+        assert decoded.filename == "missing"
+
+    def test_roundtrip(self):
+        original = Recording(
+            ["missing"], exception={"type": "PermissionError", "errno": 13}
+        )
+        restored = Recording.from_encoded_dict(original.to_encoded_dict())
+        assert restored.exception == original.exception
+
+
+class TestOutputs:
+    def test_as_recorded(self):
+        rec = Recording(["ls"], stdout=b"out", stderr=None)
+        stdout, stderr = rec.outputs(text=False)
+        assert stdout is rec.stdout
+        assert stderr is None
+
+    def test_decode(self):
+        rec = Recording(["ls"], stdout="é\r\n".encode("latin-1"), stderr=b"err")
+        assert rec.outputs(text=True, encoding="latin-1") == ("é\n", "err")
+        assert rec.outputs(text=True, encoding="ascii", errors="replace") == (
+            "�\n",
+            "err",
+        )
+
+    def test_encode(self):
+        rec = Recording(["ls"], stdout="é\n")
+        assert rec.outputs(text=False, encoding="utf-8") == ("é\n".encode(), None)
+
+    def test_cached(self):
+        rec = Recording(["ls"], stdout=b"out")
+        outputs = rec.outputs(text=True)
+        assert rec.outputs(text=True)[0] is outputs[0]
+
+        rec.stdout = b"new"
+        assert rec.outputs(text=True) == ("new", None)
@@ -7,7 +7,22 @@ try:
 except ImportError:
     from yaml import Dumper
 
-from pytest_pvcr.recordings import Recordings
+import os
+import tracemalloc
+
+import pytest
+
+from pytest_pvcr.recordings import (
+    CassetteCache,
+    MatchStrategy,
+    Recording,
+    Recordings,
+    ReplayTable,
+    StdinDigest,
+    YamlCassette,
+    open_cassette,
+    recorded_duration,
+)
 
 
 def _make_recordings(
@@ -69,6 +84,21 @@ class TestAppend:
         assert rec.rc == 0
 
 
+class TestShellCommand:
+    def test_stored_as_string(self, tmp_path):
+        recs = _make_recordings(tmp_path)
+        rec = recs.append("ls -l /tmp")
+        assert rec.args == "ls -l /tmp"
+        rec.rc = 0
+        recs.write(rec)
+
+        recs2 = _make_recordings(tmp_path, mode="none")
+        rec2 = recs2.append("ls -l /tmp")
+        assert rec2.saved is True
+        assert rec2.args == "ls -l /tmp"
+        assert recs2.append("ls -l /var").saved is False
+
+
 class TestWriteAndLoad:
     def test_write_and_reload(self, tmp_path):
         recs = _make_recordings(tmp_path)
@@ -182,6 +212,81 @@ class TestBlockUnrecorded:
         assert recs.block_unrecorded is False
 
 
+class TestHistory:
+    def test_find_all(self, tmp_path):
+        recs = _make_recordings(tmp_path)
+        recs.append(["ls"])
+        recs.append(["ls"], stdin="a")
+        recs.append(["ls"])
+        assert [r.iteration for r in recs.find_all(["ls"])] == [1, 2]
+        assert recs.find_all(["ls"])[0].args == ["ls"]
+        assert len(recs.find_all(["ls"], stdin="a")) == 1
+        assert recs.find_all(["id"]) == []
+
+    def test_payloads_released(self, tmp_path):
+        size = 1 << 18
+        tracemalloc.start()
+        try:
+            recs = _make_recordings(tmp_path, filename="test.pvcr")
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(8):
+                rec = recs.append(["cat", str(i)])
+                rec.stdout = bytes([i]) * size
+                rec.rc = 0
+                recs.write(rec)
+            del rec
+            written = tracemalloc.get_traced_memory()[0] - before
+
+            recs = _make_recordings(tmp_path, "none", "test.pvcr")
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(8):
+                rec = recs.append(["cat", str(i)])
+                assert rec.stdout == bytes([i]) * size
+            del rec
+            replayed = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+
+        # Indexed cassettes keep the outputs of commands, but the first one
+        # written to a new file
+        assert written < 2 * size
+        assert replayed < size
+
+    @pytest.mark.parametrize("filename", ["test.yaml", "test.jsonl", "test.pvcr"])
+    def test_released_payloads_reloaded(self, tmp_path, filename):
+        recs = _make_recordings(tmp_path, filename=filename)
+        for output in ("a\n", "b\n"):
+            rec = recs.append(["ls"])
+            rec.stdout = output
+            recs.write(rec)
+
+        recs.clean()
+        assert recs.append(["ls"]).stdout == "a\n"
+        assert recs.append(["ls"]).stdout == "b\n"
+        recs.clean()
+        assert recs.append(["ls"]).stdout == "a\n"
+
+    def test_loaded_outputs_kept(self, tmp_path, monkeypatch):
+        _write_yaml(
+            tmp_path / "test.yaml",
+            [{"args": ["ls", str(i)], "stdout": "a", "rc": 0} for i in range(10)],
+        )
+        reads = []
+        read = YamlCassette._read
+        monkeypatch.setattr(
+            YamlCassette, "_read", lambda self: reads.append(1) or read(self)
+        )
+
+        recs = Recordings(
+            tmp_path / "test.yaml",
+            "none",
+            match_strategy=MatchStrategy("ignore_iteration"),
+        )
+        for _ in range(5):
+            assert recs.append(["ls", "3"]).stdout == "a"
+        assert len(reads) == 1
+
+
 class TestClean:
     def test_clean_history(self, tmp_path):
         recs = _make_recordings(tmp_path)
@@ -206,3 +311,221 @@ class TestClean:
         recs2 = _make_recordings(tmp_path)
         rec2 = recs2.append(["ls"])
         assert rec2.saved is False
+
+
+class TestReplayTable:
+    def test_from_missing_file(self, tmp_path):
+        table = ReplayTable.from_file(tmp_path / "missing.yaml")
+        assert len(table) == 0
+
+    def test_immutable(self, tmp_path):
+        table = ReplayTable.from_file(tmp_path / "missing.yaml")
+        with pytest.raises(AttributeError):
+            table._entries = {}
+
+    def test_replay(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(
+            path,
+            [
+                {"args": ["ls"], "stdout": "one\n", "rc": 0, "iteration": 1},
+                {"args": ["ls"], "stdout": "two\n", "rc": 0, "iteration": 2},
+            ],
+        )
+        recs = Recordings(path, "none", replay_table=ReplayTable.from_file(path))
+        first = recs.replay(["ls"])
+        second = recs.replay(["ls"])
+        assert first.process.stdout == "one\n"
+        assert second.process.stdout == "two\n"
+        assert recs.replay(["ls"]) is None
+
+    def test_without_table(self, tmp_path):
+        recs = _make_recordings(tmp_path, mode="none")
+        assert recs.replay(["ls"]) is None
+
+    def test_miss_falls_back_to_append(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(path, [{"args": ["ls"], "rc": 0, "iteration": 1}])
+        recs = Recordings(path, "none", replay_table=ReplayTable.from_file(path))
+        assert recs.replay(["ls"]) is not None
+        rec = recs.append(["ls"])
+        assert rec.iteration == 2
+        assert rec.saved is False
+
+
+class TestCassetteCache:
+    def test_missing_file(self, tmp_path):
+        cache = CassetteCache(tmp_path / "cache")
+        assert open_cassette(tmp_path / "missing.yaml", cache).read() == []
+
+    def test_read_from_cache(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(path, [{"args": ["ls"], "rc": 0, "iteration": 1}])
+        cassette = open_cassette(path, CassetteCache(tmp_path / "cache"))
+        assert cassette.read()[0]["args"] == ["ls"]
+
+        # Same size and modification time: the cached entry is used
+        stat = path.stat()
+        _write_yaml(path, [{"args": ["id"], "rc": 0, "iteration": 1}])
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert cassette.read()[0]["args"] == ["ls"]
+
+    def test_invalidated_on_change(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(path, [{"args": ["ls"], "rc": 0, "iteration": 1}])
+        cassette = open_cassette(path, CassetteCache(tmp_path / "cache"))
+        cassette.read()
+
+        _write_yaml(path, [{"args": ["echo", "hello"], "rc": 0, "iteration": 1}])
+        assert cassette.read()[0]["args"] == ["echo", "hello"]
+
+    def test_updated_on_write(self, tmp_path):
+        cache = CassetteCache(tmp_path / "cache")
+        recs = Recordings(tmp_path / "test.yaml", "new", cache=cache)
+        rec = recs.append(["ls"])
+        rec.rc = 0
+        rec.duration = 100
+        recs.write(rec)
+
+        recs2 = Recordings(tmp_path / "test.yaml", "none", cache=cache)
+        assert recs2.append(["ls"]).saved is True
+        assert len(list((tmp_path / "cache").iterdir())) == 1
+
+
+class TestRecordedDuration:
+    def test_missing_file(self, tmp_path):
+        assert recorded_duration(tmp_path / "missing.yaml") is None
+
+    def test_total(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(
+            path,
+            [
+                {"args": ["ls"], "duration": 1500000, "iteration": 1},
+                {"args": ["ls"], "duration": 500000, "iteration": 2},
+                {"args": ["id"], "iteration": 1},
+            ],
+        )
+        assert recorded_duration(path) == 2.0
+
+
+class TestNearMisses:
+    def test_ranked(self, tmp_path):
+        _write_yaml(
+            tmp_path / "test.yaml",
+            [
+                {"args": ["kubectl", "get", "pods", "-n", "dev"], "rc": 0},
+                {
+                    "args": ["kubectl", "get", "pods", "-n", "dev"],
+                    "rc": 0,
+                    "iteration": 2,
+                },
+                {"args": ["kubectl", "get", "nodes"], "rc": 0},
+                {"args": ["ls", "-l"], "rc": 0},
+            ],
+        )
+        recs = _make_recordings(tmp_path, mode="none")
+        rec = recs.append(["kubectl", "get", "pods", "-n", "prod"])
+        near_misses = recs.near_misses(rec)
+        assert [n.recording.args for n in near_misses] == [
+            ["kubectl", "get", "pods", "-n", "dev"],
+            ["kubectl", "get", "nodes"],
+        ]
+        assert near_misses[0].similarity == 4 / 6
+
+    def test_fuzzed(self, tmp_path):
+        _write_yaml(
+            tmp_path / "test.yaml",
+            [{"args": ["cat", "[[FUZZY_VALUE]]", "-n"], "rc": 0}],
+        )
+        recs = _make_recordings(tmp_path, mode="none", fuzzy_matchers=["/tmp/.*"])
+        rec = recs.append(["cat", "/tmp/xyz", "-b"])
+        assert recs.near_misses(rec)[0].similarity == 2 / 4
+
+    def test_shell_string(self, tmp_path):
+        _write_yaml(tmp_path / "test.yaml", [{"args": "echo hello", "rc": 0}])
+        recs = _make_recordings(tmp_path, mode="none")
+        rec = recs.append("echo world")
+        assert recs.near_misses(rec)[0].recording.args == "echo hello"
+
+    def test_written_recordings(self, tmp_path):
+        recs = _make_recordings(tmp_path)
+        assert recs.near_misses(recs.append(["ls"])) == []
+
+        rec = recs.append(["ls", "-l"])
+        rec.rc = 0
+        recs.write(rec)
+        assert recs.near_misses(recs.append(["ls", "-a"]))[0].recording == rec
+
+    def test_stdin_difference(self, tmp_path):
+        _write_yaml(tmp_path / "test.yaml", [{"args": ["cat"], "stdin": "a", "rc": 0}])
+        recs = _make_recordings(tmp_path, mode="none")
+        (near_miss,) = recs.near_misses(recs.append(["cat"], stdin="b"))
+        assert near_miss.similarity == 1
+        assert near_miss.difference == (
+            f"stdin sha256:{StdinDigest.of('b').sha256[:12]} differs from "
+            f"recorded sha256:{StdinDigest.of('a').sha256[:12]}"
+        )
+
+    def test_iteration_difference(self, tmp_path):
+        _write_yaml(tmp_path / "test.yaml", [{"args": ["ls"], "rc": 0}])
+        recs = _make_recordings(tmp_path, mode="none")
+        assert recs.append(["ls"]).saved
+        (near_miss,) = recs.near_misses(recs.append(["ls"]))
+        assert near_miss.difference == "call 2 with this stdin, recorded once"
+
+    def test_args_difference(self, tmp_path):
+        _write_yaml(tmp_path / "test.yaml", [{"args": ["ls", "-l", "-a"], "rc": 0}])
+        recs = _make_recordings(tmp_path, mode="none")
+        (near_miss,) = recs.near_misses(recs.append(["ls", "-a", "-l"]))
+        assert near_miss.similarity == 1
+        assert near_miss.difference is None
+
+
+class TestSynthesize:
+    def test_template(self, tmp_path):
+        recs = _make_recordings(tmp_path, mode="none")
+        added = recs.synthesize(["tool", "--job", "{i}"], 1000, rc=1, size=4)
+        assert len(added) == 1000
+
+        rec = recs.append(["tool", "--job", "999"])
+        assert rec.saved is True
+        assert rec.rc == 1
+        assert rec.stdout == b"xxx\n"
+        assert not (tmp_path / "test.yaml").exists()
+
+    def test_iterations(self, tmp_path):
+        recs = _make_recordings(tmp_path, mode="none")
+        recs.synthesize("make", 3, rc=[0, 1, 2], seed=1)
+        rcs = [recs.append("make").rc for _ in range(3)]
+        assert recs.append("make").saved is False
+
+        recs = _make_recordings(tmp_path, mode="none")
+        recs.synthesize("make", 3, rc=[0, 1, 2], seed=1)
+        assert [recs.append("make").rc for _ in range(3)] == rcs
+
+    def test_distributions(self, tmp_path):
+        recs = _make_recordings(tmp_path)
+        added = recs.synthesize(
+            lambda i: ["curl", f"http://host/{i}"],
+            100,
+            size=lambda r: r.randint(1, 10),
+            duration=lambda r: r.expovariate(1 / 1000),
+        )
+        assert added[42].args == ["curl", "http://host/42"]
+        assert all(1 <= len(r.stdout) <= 10 for r in added)
+        assert all(r.duration > 0 for r in added)
+
+    def test_fuzzy(self, tmp_path):
+        recs = _make_recordings(tmp_path, mode="all", fuzzy_matchers=[r"/tmp/\w+"])
+        recs.synthesize(["cat", "/tmp/{i}"], 2)
+        rec = recs.append(["cat", "/tmp/other"])
+        assert rec.saved is True
+
+    def test_add_overrides_replay_table(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(path, [{"args": ["ls"], "stdout": "file\n", "rc": 0}])
+        recs = Recordings(path, "none", replay_table=ReplayTable.from_file(path))
+        recs.add([Recording(["ls"], stdout="memory\n", rc=0)])
+        assert recs.replay(["ls"]) is None
+        assert recs.append(["ls"]).stdout == "memory\n"
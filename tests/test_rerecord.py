@@ -0,0 +1,150 @@
+import os
+from pathlib import Path
+
+import pytest
+from yaml import dump
+
+try:
+    from yaml import CDumper as Dumper
+except ImportError:
+    from yaml import Dumper
+
+from pytest_pvcr.cli import main
+from pytest_pvcr.recordings import FUZZY_PLACEHOLDER, CassetteBundle, open_cassette
+from pytest_pvcr.rerecord import find_cassettes, rerecord, rerecord_cassette
+
+
+def _write_yaml(path: Path, recordings: list[dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        f.write(dump({"recordings": recordings}, Dumper=Dumper))
+
+
+class TestFindCassettes:
+    def test_find(self, tmp_path):
+        _write_yaml(tmp_path / "recordings" / "test_a" / "test_one.yaml", [])
+        _write_yaml(tmp_path / "sub" / "recordings" / "test_b" / "test_two.yaml", [])
+        _write_yaml(tmp_path / "other" / "config.yaml", [])
+        assert find_cassettes([tmp_path]) == [
+            tmp_path / "recordings" / "test_a" / "test_one.yaml",
+            tmp_path / "sub" / "recordings" / "test_b" / "test_two.yaml",
+        ]
+
+    def test_file(self, tmp_path):
+        path = tmp_path / "config.yaml"
+        _write_yaml(path, [])
+        assert find_cassettes([path]) == [path]
+
+
+class TestRerecordCassette:
+    def test_updates_outputs(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(
+            path,
+            [
+                {"args": ["echo", "hello"], "stdout": "old\n", "stderr": "", "rc": 0},
+                {
+                    "args": ["cat"],
+                    "stdin": b"same",
+                    "stdout": b"same",
+                    "stderr": b"",
+                    "rc": 0,
+                },
+            ],
+        )
+        changes, skips = rerecord_cassette(path)
+        assert [c.args for c in changes] == [["echo", "hello"]]
+        assert changes[0].fields == ("stdout",)
+        assert skips == []
+
+        recordings = open_cassette(path).read()
+        assert recordings[0]["stdout"] == "hello\n"
+        assert recordings[0]["duration"] > 0
+        assert recordings[1]["stdout"] == {"__base64__": "c2FtZQ=="}
+
+    @pytest.mark.skipif(not hasattr(os, "wait4"), reason="requires os.wait4()")
+    def test_measures_usage(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        old = {"utime": 99.0, "stime": 99.0, "maxrss": 1}
+        _write_yaml(path, [{"args": ["echo"], "stdout": "\n", "rc": 0, "usage": old}])
+        rerecord_cassette(path)
+
+        usage = open_cassette(path).read()[0]["usage"]
+        assert usage != old
+        assert usage["utime"] < 99 and usage["maxrss"] > 1
+
+    def test_skips_fuzzy(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(path, [{"args": ["cat", FUZZY_PLACEHOLDER], "rc": 0}])
+        changes, skips = rerecord_cassette(path)
+        assert changes == []
+        assert skips[0].reason == "fuzzy arguments"
+
+    def test_stdin_digest(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        digest = {"__sha256__": "0" * 64}
+        kept = {"__sha256__": "0" * 64, "raw": "kept"}
+        _write_yaml(
+            path,
+            [
+                {"args": ["cat"], "stdin": digest, "stdout": "", "stderr": "", "rc": 0},
+                {"args": ["cat"], "stdin": kept, "stdout": "", "stderr": "", "rc": 0},
+            ],
+        )
+        changes, skips = rerecord_cassette(path)
+        assert skips[0].reason == "stdin stored as digest"
+        assert changes[0].fields == ("stdout",)
+        assert open_cassette(path).read()[1]["stdout"] == "kept"
+
+    def test_skips_missing_command(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(path, [{"args": ["/nonexistent/command"], "rc": 0}])
+        changes, skips = rerecord_cassette(path)
+        assert changes == []
+        assert len(skips) == 1
+
+    def test_bundle(self, tmp_path):
+        path = tmp_path / "test_module.yaml"
+        with path.open("w") as f:
+            f.write(
+                dump(
+                    {
+                        "tests": {
+                            "test_a": [{"args": ["echo", "a"], "stdout": "", "rc": 0}],
+                            "test_b": [{"args": ["echo", "b"], "stdout": "", "rc": 0}],
+                        }
+                    },
+                    Dumper=Dumper,
+                )
+            )
+        changes, _ = rerecord_cassette(path)
+        assert [c.args for c in changes] == [["echo", "a"], ["echo", "b"]]
+        assert CassetteBundle(path).get("test_b")[0]["stdout"] == "b\n"
+
+    def test_dry_run(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(path, [{"args": ["echo", "hello"], "stdout": "old\n", "rc": 0}])
+        changes, _ = rerecord_cassette(path, dry_run=True)
+        assert len(changes) == 1
+        assert open_cassette(path).read()[0]["stdout"] == "old\n"
+
+
+class TestRerecord:
+    def test_parallel(self, tmp_path):
+        for i in range(4):
+            _write_yaml(
+                tmp_path / "recordings" / f"test_{i}.yaml",
+                [{"args": ["echo", str(i)], "stdout": "", "rc": 0}],
+            )
+
+        results = list(rerecord([tmp_path], jobs=2))
+        assert len(results) == 4
+        assert all(len(changes) == 1 for changes, _ in results)
+
+    def test_cli(self, tmp_path, capsys):
+        _write_yaml(
+            tmp_path / "recordings" / "test.yaml",
+            [{"args": ["echo", "hello"], "stdout": "old\n", "rc": 0}],
+        )
+        assert main(["rerecord", str(tmp_path)]) == 0
+        assert "1 changed command(s)" in capsys.readouterr().out
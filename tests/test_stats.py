@@ -0,0 +1,130 @@
+import json
+from pathlib import Path
+
+from yaml import dump
+
+try:
+    from yaml import CDumper as Dumper
+except ImportError:
+    from yaml import Dumper
+
+import pytest_pvcr.recordings
+import pytest_pvcr.stats
+from pytest_pvcr.cli import main
+from pytest_pvcr.recordings import _yaml
+from pytest_pvcr.stats import cassette_stats, stats
+
+
+def _write_yaml(path: Path, data: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        f.write(dump(data, Dumper=Dumper))
+
+
+class TestCassetteStats:
+    def test_recordings(self, tmp_path):
+        path = tmp_path / "test.yaml"
+        _write_yaml(
+            path,
+            {
+                "recordings": [
+                    {"args": ["ls"], "stdout": "a\n", "rc": 0, "duration": 500000},
+                    {"args": ["id"], "stderr": "", "rc": 1, "duration": 250000},
+                ]
+            },
+        )
+
+        result = cassette_stats(path)
+        assert result.size == path.stat().st_size
+        assert result.entries == 2
+        assert result.parse_time > 0
+        assert result.tests == {str(path): (2, 0.75)}
+        assert [(p.args, p.stream, p.size) for p in result.payloads] == [
+            (["ls"], "stdout", 2)
+        ]
+
+    def test_bundle(self, tmp_path):
+        path = tmp_path / "test_module.yaml"
+        _write_yaml(
+            path,
+            {
+                "tests": {
+                    "test_a": [{"args": ["ls"], "rc": 0, "duration": 1000000}],
+                    "test_b": [],
+                }
+            },
+        )
+
+        result = cassette_stats(path)
+        assert result.entries == 1
+        assert result.tests == {
+            f"{path}::test_a": (1, 1.0),
+            f"{path}::test_b": (0, 0.0),
+        }
+
+    def test_parsed_once(self, tmp_path, monkeypatch):
+        path = tmp_path / "test_module.yaml"
+        _write_yaml(path, {"tests": {"test_a": [{"args": ["ls"], "rc": 0}]}})
+
+        load, dump, Loader, Dumper = _yaml()
+        loads = []
+
+        def counted():
+            return (
+                lambda *args, **kwargs: loads.append(1) or load(*args, **kwargs),
+                dump,
+                Loader,
+                Dumper,
+            )
+
+        monkeypatch.setattr(pytest_pvcr.stats, "_yaml", counted)
+        monkeypatch.setattr(pytest_pvcr.recordings, "_yaml", counted)
+
+        assert cassette_stats(path).entries == 1
+        assert len(loads) == 1
+
+
+class TestStats:
+    def test_stats(self, tmp_path):
+        recordings = tmp_path / "recordings" / "test_module"
+        _write_yaml(
+            recordings / "test_a.yaml",
+            {
+                "recordings": [
+                    {"args": ["cat", "big"], "stdout": "x" * 100, "rc": 0},
+                    {"args": ["cat", "small"], "stdout": "y", "rc": 0},
+                ]
+            },
+        )
+        _write_yaml(
+            recordings / "test_b.yaml",
+            {
+                "recordings": [
+                    {"args": ["cat", "copy"], "stdout": "x" * 100, "duration": 10}
+                ]
+            },
+        )
+
+        result = stats([tmp_path], jobs=2, top=1)
+        assert result["totals"]["files"] == 2
+        assert result["totals"]["entries"] == 3
+        assert result["totals"]["duplicate_size"] == 100
+        parse_times = [c["parse_time"] for c in result["cassettes"]]
+        assert parse_times == sorted(parse_times, reverse=True)
+        assert result["tests"][0]["test"] == str(recordings / "test_b.yaml")
+        assert len(result["largest_payloads"]) == 1
+        assert result["largest_payloads"][0]["size"] == 100
+
+        (duplicate,) = result["duplicate_payloads"]
+        assert duplicate["count"] == 2
+        assert duplicate["wasted"] == 100
+        assert sorted(p["args"][1] for p in duplicate["payloads"]) == ["big", "copy"]
+
+    def test_cli(self, tmp_path, capsys):
+        _write_yaml(
+            tmp_path / "recordings" / "test.yaml",
+            {"recordings": [{"args": ["ls"], "stdout": "a", "rc": 0}]},
+        )
+        assert main(["stats", str(tmp_path)]) == 0
+        result = json.loads(capsys.readouterr().out)
+        assert result["totals"]["entries"] == 1